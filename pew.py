@@ -34,157 +34,2917 @@
 #
 #---------------------------------------------------------------------------------------
 
-from urllib import urlencode
-from urllib2 import urlopen, URLError
-from elementtree import ElementTree
+import cPickle as pickle
+import asyncore, calendar, copy, errno, hashlib, heapq, httplib, itertools, json, keyword, mmap, os, Queue, random, re, socket, ssl, struct, sys, tempfile, threading, time, zlib
+
+from array import array
+from collections import deque, OrderedDict
+from cStringIO import StringIO
+from datetime import datetime
+from decimal import Decimal
+from urllib import getproxies, proxy_bypass, urlencode
+from urlparse import urlsplit
+from multiprocessing.pool import Pool, ThreadPool
+
+try:
+	from xml.etree import cElementTree as ElementTree
+except ImportError:
+	try:
+		from xml.etree import ElementTree
+	except ImportError:
+		from elementtree import ElementTree
+
+try:
+	from xml.parsers import expat
+except ImportError:
+	expat = None
+
+try:
+	import fcntl
+except ImportError:
+	fcntl = None
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+def _parse_datetime(value):
+
+	if len(value) != 19:
+		raise ValueError(value)
+
+	return datetime(int(value[0:4]), int(value[5:7]), int(value[8:10]),
+		int(value[11:13]), int(value[14:16]), int(value[17:19]))
+
+def _parse_timestamp(value):
+	return float(calendar.timegm(_parse_datetime(value).timetuple()))
+
+def _parse_bool(value):
+
+	lowered = value.lower()
+
+	if lowered in ('true', '1'):
+		return True
+
+	if lowered in ('false', '0'):
+		return False
+
+	raise ValueError(value)
+
+def _column_types(converter, names):
+	return dict((name, converter) for name in names.split())
+
+_COLUMN_TYPES = {}
+
+_COLUMN_TYPES.update(_column_types(_parse_datetime, '''
+	currentTime cachedUntil paidUntil createDate logonDateTime logoffDateTime DoB date issued
+	sentDate eventDate startTime endTime trainingStartTime trainingEndTime startDate killTime
+	installTime beginProductionTime endProductionTime pauseProductionTime transactionDateTime
+	logTime changeTime onlineTimestamp stateTimestamp startDateTime researchStartDate enlisted
+	cloneJumpDate jumpActivation jumpFatigue jumpLastUpdate
+'''))
+
+_COLUMN_TYPES.update(_column_types(Decimal, '''
+	balance amount price escrow taxAmount reward collateral buyout
+'''))
+
+_COLUMN_TYPES.update(_column_types(float, '''
+	standing securityStatus taxRate pointsPerDay remainderPoints materialMultiplier timeMultiplier
+	charMaterialMultiplier charTimeMultiplier
+'''))
+
+_COLUMN_TYPES.update(_column_types(_parse_bool, '''
+	serverOpen published bid completed
+'''))
+
+_COLUMN_TYPES.update(_column_types(str, '''
+	name characterName corporationName allianceName ownerName1 ownerName2 title
+	description senderName subject typeName stationName solarSystemName shipTypeName factionName
+	ticker toCharacterIDs toListID refTypeName groupName skillName
+'''))
+
+# Columns that only appear in one rowset, keyed by rowset name. The journal's argName1 holds
+# kill IDs and names alike, so it must not be guessed at per value.
+_ROWSET_COLUMN_TYPES = {
+	'entries': {'argName1': str, 'reason': str},
+}
 
 class PewApiObject(object):
 
 	def __init__(self):
 		pass
 
+class _Missing(object):
+
+	def __reduce__(self):
+		return '_MISSING'
+
+_MISSING = _Missing()
+
+class PewApiRow(PewApiObject):
+
+	__slots__ = ()
+
+	_rowset = None
+	_converters = _COLUMN_TYPES
+
+	def __reduce__(self):
+
+		# Slot values travel as a tuple in slot order so column names are not repeated
+		# for every row; rows parsed in worker processes come back through here.
+		values = tuple([getattr(self, slot, _MISSING) for slot in self.__slots__])
+
+		return _new_row, self._rowset, (values, getattr(self, '__dict__', None) or None)
+
+	def __setstate__(self, state):
+
+		if isinstance(state, dict):
+			values, extra = (), state
+		else:
+			values, extra = state
+
+		for slot, value in zip(self.__slots__, values):
+			if value is not _MISSING:
+				setattr(self, slot, value)
+
+		if extra:
+			for attr, value in extra.items():
+				setattr(self, attr, value)
+
+class PewLazyObject(PewApiObject):
+
+	def __init__(self, parser, node):
+
+		self.__dict__['_parser'] = parser
+		self.__dict__['_node'] = node
+		self.__dict__['_children'] = None
+
+	def __getattr__(self, name):
+
+		if name.startswith('__'):
+			raise AttributeError(name)
+
+		node = self.__dict__['_node']
+		parser = self.__dict__['_parser']
+		children = self._child_index()
+
+		if name in children:
+			value = parser._lazy_xml(children[name])
+		elif name in node.attrib:
+			value = parser._convert_value(_COLUMN_TYPES.get(name), node.attrib[name])
+		elif name == '_value' and node.text is not None and len(node.text.strip()) > 0:
+			value = node.text
+		else:
+			raise AttributeError(name)
+
+		# Memoized in the instance dict, so __getattr__ is not consulted again.
+		self.__dict__[name] = value
+
+		return value
+
+	def __dir__(self):
+		return sorted(set(self.__dict__) | set(self._child_index()) | set(self.__dict__['_node'].attrib))
+
+	def _child_index(self):
+
+		children = self.__dict__['_children']
+
+		if children is None:
+			children = {}
+
+			for child in self.__dict__['_node']:
+				children[child.get('name') if child.tag == 'rowset' else child.tag] = child
+
+			self.__dict__['_children'] = children
+
+		return children
+
+class PewColumns(object):
+
+	def __init__(self, name, data):
+
+		self.name = name
+		self.columns = tuple(data)
+		self.data = data
+
+	def __len__(self):
+		return len(self.data[self.columns[0]]) if self.columns else 0
+
+	def __getitem__(self, column):
+		return self.data[column]
+
+	def __getattr__(self, column):
+
+		try:
+			return self.__dict__['data'][column]
+		except KeyError:
+			raise AttributeError(column)
+
+	def __getstate__(self):
+		return self.__dict__
+
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+
+class _PewColumnBuilder(object):
+
+	def __init__(self, converter):
+
+		self.typecode = None
+		self.values = []
+
+		if converter in (Decimal, float):
+			self.typecode, self.cast, self.missing = 'd', float, float('nan')
+		elif converter is _parse_datetime:
+			self.typecode, self.cast, self.missing = 'd', _parse_timestamp, float('nan')
+		elif converter is _parse_bool:
+			self.typecode, self.cast, self.missing = 'b', _parse_bool, 0
+		elif converter is None or converter is int:
+			self.typecode, self.cast, self.missing = 'l', int, 0
+
+		if self.typecode is not None:
+			self.values = array(self.typecode)
+
+	def append(self, value):
+
+		if self.typecode is not None:
+			if value is None or value == '':
+				self.values.append(self.missing)
+				return
+
+			try:
+				self.values.append(self.cast(value) if isinstance(value, basestring) else self._coerce(value))
+				return
+			except (ValueError, OverflowError):
+				# The column is not numeric after all; keep it as a plain list.
+				self.values = list(self.values)
+				self.typecode = None
+
+		self.values.append(value)
+
+	def _coerce(self, value):
+
+		# Values taken from already parsed rows rather than from attribute strings.
+		if isinstance(value, datetime):
+			return float(calendar.timegm(value.timetuple()))
+
+		return float(value) if self.typecode == 'd' else int(value)
+
+	def finish(self, use_numpy):
+
+		if self.typecode is not None and use_numpy:
+			return numpy.frombuffer(self.values, dtype = self.typecode)
+
+		return self.values
+
+_NON_ASCII = re.compile(r'[\x80-\xff]')
+
+class _PewExpatBuilder(object):
+
+	# Builds results straight from expat events, following the same rules as
+	# Pew._r_parse_xml on an element tree: only text before the first child counts,
+	# attributes are set before children and nodes without attributes or children
+	# become plain values.
+	_ROWSET, _NODE = 0, 1
+
+	def __init__(self, pew):
+
+		self._pew = pew
+		self._stack = []
+		self._names = {}
+		self.result = None
+
+	def parse(self, xml):
+
+		parser = expat.ParserCreate()
+		parser.buffer_text = True
+		parser.returns_unicode = False
+		parser.StartElementHandler = self._start
+		parser.EndElementHandler = self._end
+		parser.CharacterDataHandler = self._data
+		parser.Parse(xml, True)
+
+		return self.result
+
+	def _text(self, value):
+
+		# ElementTree keeps ASCII text as str and only returns unicode when it must.
+		if _NON_ASCII.search(value) is None:
+			return value
+
+		return value.decode('utf-8')
+
+	def _name(self, value):
+
+		name = self._names.get(value)
+
+		if name is None:
+			name = self._names[value] = self._text(value)
+
+		return name
+
+	def _start(self, tag, attrs):
+
+		stack = self._stack
+		tag = self._name(tag)
+		obj_type = PewApiObject
+
+		if stack:
+			parent = stack[-1]
+			parent[3] = True
+
+			if parent[0] == self._ROWSET:
+				obj_type = parent[5]
+			elif parent[2] is None:
+				parent[2] = parent[5]()
+
+		if tag == 'rowset':
+			name = attrs.get('name')
+			columns = attrs.get('columns')
+			row_type = _row_type(self._text(name), self._text(columns)) if columns is not None else PewApiObject
+			stack.append([self._ROWSET, self._text(name) if name is not None else None, [], True, None, row_type])
+			return
+
+		obj = None
+
+		if attrs:
+			obj = obj_type()
+			converters = getattr(obj_type, '_converters', _COLUMN_TYPES)
+			convert = self._pew._convert_value
+
+			for attr, value in attrs.iteritems():
+				attr = self._name(attr)
+				setattr(obj, attr, convert(converters.get(attr), self._text(value)))
+
+		stack.append([self._NODE, tag, obj, False, [], obj_type])
+
+	def _data(self, data):
+
+		frame = self._stack[-1]
+
+		if not frame[3]:
+			frame[4].append(data)
+
+	def _end(self, tag):
+
+		kind, tag, obj, has_child, text, obj_type = self._stack.pop()
+
+		if kind == self._ROWSET:
+			value = obj
+		else:
+			text = self._text(''.join(text)) if text else None
+			has_value = text is not None and len(text.strip()) > 0
+
+			if obj is not None:
+				if has_value:
+					obj._value = text
+
+				value = obj
+			elif has_value:
+				value = self._pew._convert_value(_COLUMN_TYPES.get(tag), text)
+			else:
+				value = None
+
+		if not self._stack:
+			self.result = value
+			return
+
+		parent = self._stack[-1]
+
+		if parent[0] == self._ROWSET:
+			parent[2].append(value)
+		else:
+			setattr(parent[2], tag, value)
+
+_ROW_TYPES = {}
+_ROW_TYPES_LOCK = threading.Lock()
+
+def _new_row(name, columns):
+	return _row_type(name, columns)()
+
+_IDENTIFIER = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+def _row_type(name, columns):
+
+	key = (name, columns)
+	row_type = _ROW_TYPES.get(key)
+
+	if row_type is not None:
+		return row_type
+
+	with _ROW_TYPES_LOCK:
+		row_type = _ROW_TYPES.get(key)
+
+		if row_type is None:
+			slots = []
+
+			for column in columns.split(','):
+				column = column.strip()
+
+				if _IDENTIFIER.match(column) and not keyword.iskeyword(column) and column not in slots:
+					slots.append(column)
+
+			converters = dict(_COLUMN_TYPES)
+			converters.update(_ROWSET_COLUMN_TYPES.get(name, {}))
+
+			# Declared columns live in slots; anything else a row carries (nested rowsets,
+			# text values, undeclared attributes) falls back to the instance dict.
+			row_type = type('PewApiRow', (PewApiRow,), {
+				'__slots__': tuple(slots),
+				'_rowset': key,
+				'_converters': converters,
+			})
+			_ROW_TYPES[key] = row_type
+
+	return row_type
+
+class PewMemoryCache(object):
+
+	def __init__(self, max_entries = 1000):
+
+		self.max_entries = max_entries
+		self._entries = OrderedDict()
+		self._lock = threading.Lock()
+
+	def get(self, key):
+
+		with self._lock:
+			entry = self._entries.pop(key, None)
+
+			if entry is None or entry[0] <= time.time():
+				return None
+
+			self._entries[key] = entry
+
+			return entry[1]
+
+	def set(self, key, value, expires):
+
+		with self._lock:
+			self._entries.pop(key, None)
+			self._entries[key] = (expires, value)
+
+			while len(self._entries) > self.max_entries:
+				self._entries.popitem(last = False)
+
+	def clear(self):
+
+		with self._lock:
+			self._entries.clear()
+
+class PewDiskCache(object):
+
+	_HEADER = struct.Struct('<d')
+
+	def __init__(self, path, max_bytes = 256 * 1024 * 1024):
+
+		self.path = path
+		self.max_bytes = max_bytes
+		self._size = None
+		self._lock = threading.Lock()
+
+		self._makedirs(path)
+
+	def get(self, key):
+
+		path = self._entry_path(key)
+
+		try:
+			with open(path, 'rb') as f:
+				data = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+		except (EnvironmentError, ValueError):
+			return None
+
+		try:
+			expires = self._HEADER.unpack_from(data)[0]
+
+			if expires <= time.time():
+				return None
+
+			# Unpickling from the map itself avoids copying the entry into a string first.
+			data.seek(self._HEADER.size)
+			value = pickle.load(data)
+
+		# Truncated or stale entries (such as pickles of classes that have since moved)
+		# fail in many ways; all of them are misses.
+		except (struct.error, pickle.UnpicklingError, EOFError, ValueError, AttributeError, ImportError, IndexError):
+			return None
+
+		finally:
+			data.close()
+
+		try:
+			os.utime(path, None)
+		except OSError:
+			pass
+
+		return value
+
+	def set(self, key, value, expires):
+
+		try:
+			data = self._HEADER.pack(expires) + pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+		except (pickle.PicklingError, TypeError):
+			return
+
+		path = self._entry_path(key)
+		self._makedirs(os.path.dirname(path))
+
+		try:
+			_write_atomic(path, data)
+		except EnvironmentError:
+			return
+
+		self._track(len(data))
+
+	def clear(self):
+
+		with self._lock:
+			for path, mtime, size in self._entries():
+				self._remove(path)
+
+			self._size = 0
+
+	def _entry_path(self, key):
+
+		digest = hashlib.sha1(repr(key)).hexdigest()
+
+		return os.path.join(self.path, digest[:2], digest[2:])
+
+	def _entries(self):
+
+		entries = []
+
+		for root, dirs, files in os.walk(self.path):
+			for name in files:
+				if name.startswith('.'):
+					continue
+
+				path = os.path.join(root, name)
+
+				try:
+					stat = os.stat(path)
+				except OSError:
+					continue
+
+				entries.append((path, stat.st_mtime, stat.st_size))
+
+		return entries
+
+	def _track(self, size):
+
+		with self._lock:
+			if self._size is None:
+				self._size = sum(entry[2] for entry in self._entries())
+			else:
+				self._size += size
+
+			if self._size > self.max_bytes:
+				self._evict()
+
+	def _evict(self):
+
+		entries = sorted(self._entries(), key = lambda entry: entry[1])
+		self._size = sum(entry[2] for entry in entries)
+		target = self.max_bytes * 0.9
+
+		for path, mtime, size in entries:
+			if self._size <= target:
+				break
+
+			self._remove(path)
+			self._size -= size
+
+	def _remove(self, path):
+		_remove_file(path)
+
+	def _makedirs(self, path):
+		_makedirs(path)
+
+class PewMemorySyncStore(object):
+
+	def __init__(self):
+
+		self._marks = {}
+		self._lock = threading.Lock()
+
+	def get(self, key):
+
+		with self._lock:
+			return self._marks.get(key)
+
+	def set(self, key, value):
+
+		with self._lock:
+			self._marks[key] = value
+
+class PewFileSyncStore(object):
+
+	def __init__(self, path):
+
+		self.path = path
+		self._lock = threading.Lock()
+
+		try:
+			with open(path, 'rb') as f:
+				self._marks = json.load(f)
+		except (EnvironmentError, ValueError):
+			self._marks = {}
+
+	def get(self, key):
+
+		with self._lock:
+			return self._marks.get(repr(key))
+
+	def set(self, key, value):
+
+		with self._lock:
+			self._marks[repr(key)] = value
+			_write_atomic(self.path, json.dumps(self._marks))
+
+class PewReferenceData(object):
+
+	_DATASETS = {
+		'skills': 'eve_skill_tree',
+		'certificates': 'eve_certificate_tree',
+		'ref_types': 'eve_reference_types',
+		'alliances': 'eve_alliance_list',
+		'stations': 'eve_conquerable_station_list',
+		'errors': 'eve_error_list',
+	}
+
+	_shared = None
+	_shared_lock = threading.Lock()
+
+	def __init__(self, pew = None, path = None, retry_interval = 300):
+
+		self.pew = pew if pew is not None else Pew()
+		self.pew._require_blocking('PewReferenceData')
+		self.path = path
+		self.retry_interval = retry_interval
+		self._data = {}
+		self._refreshing = set()
+		self._lock = threading.Lock()
+
+		if path is not None:
+			_makedirs(path)
+
+	@classmethod
+	def shared(cls, pew = None, path = None):
+
+		with cls._shared_lock:
+			if cls._shared is None:
+				cls._shared = cls(pew, path)
+
+			return cls._shared
+
+	def skill(self, type_id):
+		return self.get('skills').get(type_id)
+
+	def certificate(self, certificate_id):
+		return self.get('certificates').get(certificate_id)
+
+	def ref_type(self, ref_type_id):
+		return self.get('ref_types').get(ref_type_id)
+
+	def alliance(self, alliance_id):
+		return self.get('alliances')['alliances'].get(alliance_id)
+
+	def alliance_of(self, corporation_id):
+		return self.alliance(self.get('alliances')['corporations'].get(corporation_id))
+
+	def station(self, station_id):
+		return self.get('stations').get(station_id)
+
+	def error(self, code):
+		return self.get('errors').get(code)
+
+	def get(self, name):
+
+		with self._lock:
+			entry = self._data.get(name)
+
+			if entry is None:
+				entry = self._load(name)
+
+			if entry is not None and entry[0] is not None and entry[0] <= time.time() and name not in self._refreshing:
+				# Stale data keeps being served while a single background refresh runs.
+				self._refreshing.add(name)
+				thread = threading.Thread(target = self._refresh, args = (name,))
+				thread.daemon = True
+				thread.start()
+
+		if entry is None:
+			entry = self._update(name)
+
+		return entry[1]
+
+	def _refresh(self, name):
+
+		# Any failure, including garbled or reshaped responses, waits out retry_interval;
+		# otherwise every read of the stale entry would start another fetch.
+		try:
+			self._update(name)
+		except Exception:
+			with self._lock:
+				self._data[name] = (time.time() + self.retry_interval, self._data[name][1])
+		finally:
+			with self._lock:
+				self._refreshing.discard(name)
+
+	def _update(self, name):
+
+		result = getattr(self.pew, self._DATASETS[name])()
+		entry = (getattr(result, '_expires', None), getattr(self, '_index_%s' % name)(result))
+
+		# Indexes are replaced whole rather than mutated, so an index already handed out never changes.
+		with self._lock:
+			self._data[name] = entry
+
+		if self.path is not None:
+			_write_atomic(self._file(name), pickle.dumps(entry, pickle.HIGHEST_PROTOCOL))
+
+		return entry
+
+	def _load(self, name):
+
+		if self.path is None:
+			return None
+
+		try:
+			with open(self._file(name), 'rb') as f:
+				entry = pickle.load(f)
+		except (EnvironmentError, pickle.UnpicklingError, EOFError):
+			return None
+
+		self._data[name] = entry
+
+		return entry
+
+	def _file(self, name):
+		return os.path.join(self.path, '%s.pickle' % name)
+
+	def _index_skills(self, result):
+		return dict((skill.typeID, skill) for group in result.skillGroups for skill in group.skills)
+
+	def _index_certificates(self, result):
+		return dict((certificate.certificateID, certificate) for category in result.categories for cert_class in category.classes for certificate in cert_class.certificates)
+
+	def _index_ref_types(self, result):
+		return dict((row.refTypeID, row.refTypeName) for row in result.refTypes)
+
+	def _index_alliances(self, result):
+
+		alliances = dict((alliance.allianceID, alliance) for alliance in result.alliances)
+		corporations = dict((corp.corporationID, alliance.allianceID) for alliance in result.alliances for corp in alliance.memberCorporations)
+
+		return {'alliances': alliances, 'corporations': corporations}
+
+	def _index_stations(self, result):
+		return dict((row.stationID, row) for row in result.outposts)
+
+	def _index_errors(self, result):
+		return dict((row.errorCode, row.errorText) for row in result.errors)
+
+class PewRateLimiter(object):
+
+	def __init__(self, rate, burst = None):
+
+		self.rate = float(rate)
+		self.burst = float(burst if burst is not None else max(rate, 1))
+		self._tokens = self.burst
+		self._updated = time.time()
+		self._lock = threading.Lock()
+
+	def acquire(self, tokens = 1):
+
+		while True:
+			delay = self._reserve(tokens)
+
+			if delay <= 0:
+				return
+
+			time.sleep(delay)
+
+	def _reserve(self, tokens):
+
+		with self._lock:
+			return self._take(tokens)
+
+	def _take(self, tokens):
+
+		now = time.time()
+		self._tokens = min(self.burst, self._tokens + max(now - self._updated, 0) * self.rate)
+		self._updated = now
+
+		if self._tokens >= tokens:
+			self._tokens -= tokens
+			return 0
+
+		return (tokens - self._tokens) / self.rate
+
+class PewFileRateLimiter(PewRateLimiter):
+
+	_STATE = struct.Struct('<dd')
+
+	def __init__(self, path, rate, burst = None):
+		super(PewFileRateLimiter, self).__init__(rate, burst)
+
+		if fcntl is None:
+			raise NotImplementedError('PewFileRateLimiter requires fcntl')
+
+		self.path = path
+
+	def _reserve(self, tokens):
+
+		# The bucket state lives in the file, guarded by an exclusive lock, so every
+		# process using the same path draws from one bucket.
+		with self._lock:
+			fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+
+			try:
+				fcntl.flock(fd, fcntl.LOCK_EX)
+				data = os.read(fd, self._STATE.size)
+
+				if len(data) == self._STATE.size:
+					self._tokens, self._updated = self._STATE.unpack(data)
+				else:
+					self._tokens, self._updated = self.burst, time.time()
+
+				delay = self._take(tokens)
+
+				os.lseek(fd, 0, os.SEEK_SET)
+				os.write(fd, self._STATE.pack(self._tokens, self._updated))
+
+			finally:
+				os.close(fd)
+
+		return delay
+
+class PewErrorBudget(object):
+
+	def __init__(self, max_errors = 250, window = 180):
+
+		self.max_errors = max_errors
+		self.window = window
+		self._errors = {}
+		self._lock = threading.Lock()
+
+	def record(self, key):
+
+		with self._lock:
+			self._errors.setdefault(key, deque()).append(time.time())
+
+	def delay(self, key):
+
+		with self._lock:
+			errors = self._errors.get(key)
+
+			if not errors:
+				return 0
+
+			cutoff = time.time() - self.window
+
+			while errors and errors[0] <= cutoff:
+				errors.popleft()
+
+			if len(errors) < self.max_errors:
+				return 0
+
+			return errors[len(errors) - self.max_errors] - cutoff
+
+	def wait(self, key):
+
+		while True:
+			delay = self.delay(key)
+
+			if delay <= 0:
+				return
+
+			time.sleep(delay)
+
+class PewSubscription(object):
+
+	def __init__(self, method, args, kwargs, callback):
+
+		self.method = method
+		self.args = args
+		self.kwargs = kwargs
+		self.callback = callback
+		self.cancelled = False
+
+class PewScheduler(object):
+
+	def __init__(self, workers = 8, retry_interval = 300, min_interval = 1):
+
+		self.workers = workers
+		self.retry_interval = retry_interval
+		self.min_interval = min_interval
+		self._heap = []
+		self._sequence = itertools.count()
+		self._condition = threading.Condition()
+		self._running = False
+		self._thread = None
+		self._pool = None
+
+	def subscribe(self, method, args = (), kwargs = None, callback = None, due = None):
+
+		subscription = PewSubscription(method, tuple(args), kwargs or {}, callback)
+		self._schedule(subscription, due if due is not None else time.time())
+
+		return subscription
+
+	def unsubscribe(self, subscription):
+
+		# Cancelled entries stay in the heap and are skipped when they reach the top.
+		subscription.cancelled = True
+
+	def start(self):
+
+		with self._condition:
+			if self._running:
+				return
+
+			self._running = True
+			self._pool = ThreadPool(self.workers)
+			self._thread = threading.Thread(target = self._dispatch)
+			self._thread.daemon = True
+			self._thread.start()
+
+	def stop(self):
+
+		with self._condition:
+			self._running = False
+			self._condition.notify_all()
+
+		if self._thread is not None:
+			self._thread.join()
+			self._pool.close()
+			self._pool.join()
+			self._thread = None
+
+	def _schedule(self, subscription, due):
+
+		with self._condition:
+			heapq.heappush(self._heap, (due, next(self._sequence), subscription))
+			self._condition.notify()
+
+	def _dispatch(self):
+
+		with self._condition:
+			while self._running:
+				if not self._heap:
+					self._condition.wait()
+					continue
+
+				due, sequence, subscription = self._heap[0]
+
+				if subscription.cancelled:
+					heapq.heappop(self._heap)
+					continue
+
+				delay = due - time.time()
+
+				if delay > 0:
+					self._condition.wait(delay)
+					continue
+
+				heapq.heappop(self._heap)
+				self._pool.apply_async(self._execute, (subscription,))
+
+	def _execute(self, subscription):
+
+		result = None
+		error = None
+
+		try:
+			result = subscription.method(*subscription.args, **subscription.kwargs)
+		except Exception as er:
+			error = er
+
+		now = time.time()
+
+		if error is not None:
+			due = now + self.retry_interval
+		else:
+			due = max(getattr(result, '_expires', None) or now + self.retry_interval, now + self.min_interval)
+
+		if not subscription.cancelled:
+			self._schedule(subscription, due)
+
+		if subscription.callback is not None:
+			subscription.callback(subscription, result, error)
+
+class PewAssetIndex(object):
+
+	def __init__(self, assets):
+
+		self.items = {}
+		self.parents = {}
+		self.locations = {}
+		self.by_type = {}
+		self.by_location = {}
+		self.children = {}
+		self._quantities = {}
+
+		# Walked with an explicit stack so deeply nested containers cannot hit the
+		# recursion limit; works equally on a parsed rowset or a streaming generator.
+		for root in assets:
+			stack = [(root, None, getattr(root, 'locationID', None))]
+
+			while stack:
+				row, parent_id, location_id = stack.pop()
+				self._add(row, parent_id, location_id)
+
+				for child in reversed(getattr(row, 'contents', None) or []):
+					stack.append((child, row.itemID, location_id))
+
+	def __len__(self):
+		return len(self.items)
+
+	def __iter__(self):
+		return iter(self.items.values())
+
+	def item(self, item_id):
+		return self.items.get(item_id)
+
+	def parent(self, item_id):
+		return self.items.get(self.parents.get(item_id))
+
+	def location(self, item_id):
+		return self.locations.get(item_id)
+
+	def contents(self, item_id):
+		return self.children.get(item_id, [])
+
+	def of_type(self, type_id):
+		return self.by_type.get(type_id, [])
+
+	def at(self, location_id):
+		return self.by_location.get(location_id, [])
+
+	def quantities(self, location_id):
+		return dict(self._quantities.get(location_id, {}))
+
+	def _add(self, row, parent_id, location_id):
+
+		item_id = row.itemID
+		type_id = getattr(row, 'typeID', None)
+
+		self.items[item_id] = row
+		self.parents[item_id] = parent_id
+		self.locations[item_id] = location_id
+		self.by_type.setdefault(type_id, []).append(row)
+		self.by_location.setdefault(location_id, []).append(row)
+
+		if parent_id is not None:
+			self.children.setdefault(parent_id, []).append(row)
+
+		totals = self._quantities.setdefault(location_id, {})
+		totals[type_id] = totals.get(type_id, 0) + getattr(row, 'quantity', 1)
+
+class PewOrderEvent(object):
+
+	__slots__ = ('kind', 'key', 'order_id', 'order', 'previous')
+
+	def __init__(self, kind, key, order_id, order, previous):
+
+		self.kind = kind
+		self.key = key
+		self.order_id = order_id
+		self.order = order
+		self.previous = previous
+
+	def __repr__(self):
+		return 'PewOrderEvent(%r, %r, %r)' % (self.kind, self.key, self.order_id)
+
+class PewOrderBook(object):
+
+	_OPEN = 0
+
+	def __init__(self, callback = None):
+
+		self.callback = callback
+		self._snapshots = {}
+		self._lock = threading.Lock()
+
+	def poll(self, pew, character_id, corp = False):
+
+		pew._require_blocking('PewOrderBook')
+		result = pew.corp_market_orders(character_id) if corp else pew.char_market_orders(character_id)
+		key = ('corp' if corp else 'char', character_id)
+
+		return self.update(key, result.orders)
+
+	def update(self, key, orders):
+
+		# Each order is kept as a (price, volRemaining, orderState) tuple, and the new
+		# snapshot is compared with the previous one by orderID in a single pass.
+		snapshot = {}
+		events = []
+
+		with self._lock:
+			previous = self._snapshots.get(key, {})
+
+			for order in orders:
+				order_id = order.orderID
+				state = (order.price, order.volRemaining, order.orderState)
+				snapshot[order_id] = state
+				old = previous.get(order_id)
+
+				if old is None:
+					events.append(PewOrderEvent('created', key, order_id, order, None))
+					continue
+
+				if state == old:
+					continue
+
+				if state[0] != old[0]:
+					events.append(PewOrderEvent('price_changed', key, order_id, order, old))
+
+				if state[1] < old[1]:
+					events.append(PewOrderEvent('filled', key, order_id, order, old))
+
+				if state[2] != old[2] and old[2] == self._OPEN:
+					events.append(PewOrderEvent('closed', key, order_id, order, old))
+
+			for order_id, old in previous.items():
+				if order_id not in snapshot:
+					events.append(PewOrderEvent('removed', key, order_id, None, old))
+
+			self._snapshots[key] = snapshot
+
+		if self.callback is not None:
+			for event in events:
+				self.callback(event)
+
+		return events
+
+	def state(self, key, order_id):
+		return self._snapshots.get(key, {}).get(order_id)
+
+	def forget(self, key):
+
+		with self._lock:
+			self._snapshots.pop(key, None)
+
+class PewMetrics(object):
+
+	_PHASES = ('connect', 'server', 'transfer', 'parse')
+	_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+	def __init__(self, buckets = None):
+
+		self.buckets = tuple(buckets) if buckets is not None else self._BUCKETS
+		self._methods = {}
+		self._lock = threading.Lock()
+
+	def attach(self, pew):
+
+		pew.add_hook('request', self._on_request)
+		pew.add_hook('response', self._on_response)
+		pew.add_hook('parse', self._on_parse)
+		pew.add_hook('error', self._on_error)
+		pew.add_hook('cache', self._on_cache)
+		pew.add_hook('shared', self._on_shared)
+
+		return self
+
+	def detach(self, pew):
+
+		pew.remove_hook('request', self._on_request)
+		pew.remove_hook('response', self._on_response)
+		pew.remove_hook('parse', self._on_parse)
+		pew.remove_hook('error', self._on_error)
+		pew.remove_hook('cache', self._on_cache)
+		pew.remove_hook('shared', self._on_shared)
+
+	def snapshot(self):
+
+		with self._lock:
+			return copy.deepcopy(self._methods)
+
+	def export(self):
+
+		lines = []
+		methods = sorted(self.snapshot().items())
+		counters = [
+			('pew_requests_total', 'requests', 'API requests sent.'),
+			('pew_cache_hits_total', 'cache_hits', 'Results served from the cache.'),
+			('pew_shared_total', 'shared', 'Results shared with an identical request in flight.'),
+			('pew_response_bytes_total', 'bytes', 'Decoded response body bytes.'),
+		]
+
+		for name, field, description in counters:
+			lines.append('# HELP %s %s' % (name, description))
+			lines.append('# TYPE %s counter' % name)
+
+			for key, stats in methods:
+				lines.append('%s{%s} %d' % (name, self._labels(key), stats[field]))
+
+		lines.append('# HELP pew_errors_total API and connection errors by code.')
+		lines.append('# TYPE pew_errors_total counter')
+
+		for key, stats in methods:
+			for code, count in sorted(stats['errors'].items()):
+				lines.append('pew_errors_total{%s,code="%s"} %d' % (self._labels(key), code, count))
+
+		lines.append('# HELP pew_phase_seconds Request latency by phase.')
+		lines.append('# TYPE pew_phase_seconds histogram')
+
+		for key, stats in methods:
+			for phase in self._PHASES:
+				counts, total, count = stats['phases'][phase]
+				labels = '%s,phase="%s"' % (self._labels(key), phase)
+				cumulative = 0
+
+				for bound, bucket_count in zip(self.buckets, counts):
+					cumulative += bucket_count
+					lines.append('pew_phase_seconds_bucket{%s,le="%s"} %d' % (labels, bound, cumulative))
+
+				lines.append('pew_phase_seconds_bucket{%s,le="+Inf"} %d' % (labels, count))
+				lines.append('pew_phase_seconds_sum{%s} %f' % (labels, total))
+				lines.append('pew_phase_seconds_count{%s} %d' % (labels, count))
+
+		return '\n'.join(lines) + '\n'
+
+	def _labels(self, key):
+		return 'api_type="%s",method="%s"' % key
+
+	def _stats(self, info):
+
+		key = (info['api_type'], info['method_name'])
+		stats = self._methods.get(key)
+
+		if stats is None:
+			stats = self._methods[key] = {
+				'requests': 0,
+				'cache_hits': 0,
+				'shared': 0,
+				'bytes': 0,
+				'errors': {},
+				'phases': dict((phase, [[0] * len(self.buckets), 0.0, 0]) for phase in self._PHASES),
+			}
+
+		return stats
+
+	def _observe(self, stats, phase, seconds):
+
+		histogram = stats['phases'][phase]
+		histogram[1] += seconds
+		histogram[2] += 1
+
+		for i, bound in enumerate(self.buckets):
+			if seconds <= bound:
+				histogram[0][i] += 1
+				break
+
+	def _on_request(self, info):
+
+		with self._lock:
+			self._stats(info)['requests'] += 1
+
+	def _on_response(self, info):
+
+		with self._lock:
+			stats = self._stats(info)
+			stats['bytes'] += info.get('bytes', 0)
+
+			for phase in ('connect', 'server', 'transfer'):
+				if phase in info:
+					self._observe(stats, phase, info[phase])
+
+	def _on_parse(self, info):
+
+		with self._lock:
+			self._observe(self._stats(info), 'parse', info['parse'])
+
+	def _on_error(self, info):
+
+		error = info['error']
+
+		if isinstance(error, PewApiError):
+			code = error.code
+		elif isinstance(error, PewConnectionError):
+			code = 'connection'
+		else:
+			code = type(error).__name__
+
+		with self._lock:
+			errors = self._stats(info)['errors']
+			errors[code] = errors.get(code, 0) + 1
+
+	def _on_cache(self, info):
+
+		with self._lock:
+			self._stats(info)['cache_hits'] += 1
+
+	def _on_shared(self, info):
+
+		with self._lock:
+			self._stats(info)['shared'] += 1
+
+class PewConnectionPool(object):
+
+	_CONNECTION_TYPES = {'http': httplib.HTTPConnection, 'https': httplib.HTTPSConnection}
+
+	def __init__(self, max_size = 4, timeout = 30, proxies = None):
+
+		self.max_size = max_size
+		self.timeout = timeout
+		self.proxies = getproxies() if proxies is None else proxies
+		self._idle = {}
+		self._busy = {}
+		self._lock = threading.Lock()
+		self._available = threading.Condition(self._lock)
+
+	def request(self, url, timing = None):
+
+		stream = self.open(url, timing)
+
+		try:
+			if timing is None:
+				return stream.read()
+
+			start = time.time()
+			body = stream.read()
+			timing['transfer'] = time.time() - start
+			timing['bytes'] = len(body)
+
+			return body
+		finally:
+			stream.close()
+
+	def open(self, url, timing = None):
+
+		parts = urlsplit(url)
+		host = (parts.scheme, parts.hostname, parts.port)
+		path = parts.path
+
+		if parts.query:
+			path = '%s?%s' % (path, parts.query)
+
+		# Plain HTTP proxies take the full URL; HTTPS goes through a CONNECT tunnel.
+		if parts.scheme == 'http' and self._proxy(parts.scheme, parts.hostname) is not None:
+			path = url
+
+		start = time.time()
+		connection, reused = self._acquire(host)
+
+		try:
+			if timing is not None:
+				# Connecting explicitly separates TCP and TLS setup from server time.
+				if not reused:
+					connection.connect()
+
+				timing['connect'] = time.time() - start
+				start = time.time()
+
+			try:
+				response = self._send(connection, parts.netloc, path)
+			except (socket.error, httplib.HTTPException):
+				# The server may have dropped an idle keep-alive connection; retry once
+				# on a fresh one before giving up.
+				connection.close()
+
+				if not reused:
+					raise
+
+				connection = self._connect(host)
+				response = self._send(connection, parts.netloc, path)
+
+		# Every failure must give the slot back, or the host is wedged at max_size.
+		except (socket.error, httplib.HTTPException, ssl.CertificateError) as er:
+			self._discard(host, connection)
+			raise PewConnectionError(str(er))
+		except Exception:
+			self._discard(host, connection)
+			raise
+
+		if timing is not None:
+			timing['server'] = time.time() - start
+
+		stream = PewResponseStream(self, host, connection, response)
+
+		if response.status != 200:
+			try:
+				stream.read()
+			finally:
+				stream.close()
+
+			raise PewConnectionError('HTTP Error %d: %s' % (response.status, response.reason))
+
+		return stream
+
+	def clear(self):
+
+		with self._lock:
+			for connections in self._idle.values():
+				for connection in connections:
+					connection.close()
+
+			self._idle.clear()
+
+	def _send(self, connection, netloc, path):
+
+		connection.request('GET', path, headers = {
+			'Host': netloc,
+			'Accept-Encoding': 'gzip, deflate',
+			'Connection': 'keep-alive',
+		})
+
+		return connection.getresponse()
+
+	def _acquire(self, host):
+
+		deadline = time.time() + self.timeout
+
+		with self._available:
+			# max_size also bounds the connections checked out per host, so callers beyond
+			# it wait for one to come back instead of opening more.
+			while self._busy.get(host, 0) >= self.max_size:
+				remaining = deadline - time.time()
+
+				if remaining <= 0:
+					raise PewConnectionError('no free connection to %s within %s seconds' % (host[1], self.timeout))
+
+				self._available.wait(remaining)
+
+			self._busy[host] = self._busy.get(host, 0) + 1
+			connections = self._idle.get(host)
+
+			if connections:
+				return connections.pop(), True
+
+		try:
+			return self._connect(host), False
+		except Exception:
+			with self._available:
+				self._checkin(host)
+
+			raise
+
+	def _release(self, host, connection):
+
+		with self._available:
+			self._checkin(host)
+			connections = self._idle.setdefault(host, [])
+
+			if len(connections) < self.max_size:
+				connections.append(connection)
+				return
+
+		connection.close()
+
+	def _discard(self, host, connection):
+
+		connection.close()
+
+		with self._available:
+			self._checkin(host)
+
+	def _checkin(self, host):
+
+		self._busy[host] -= 1
+		self._available.notify()
+
+	def _connect(self, host):
+
+		scheme, hostname, port = host
+
+		try:
+			connection_type = self._CONNECTION_TYPES[scheme]
+		except KeyError:
+			raise PewConnectionError('unsupported url scheme: %s' % scheme)
+
+		proxy = self._proxy(scheme, hostname)
+
+		if proxy is None:
+			return connection_type(hostname, port, timeout = self.timeout)
+
+		# Proxies given as host:port are plain HTTP proxies.
+		if '://' not in proxy:
+			proxy = 'http://%s' % proxy
+
+		proxy = urlsplit(proxy)
+		connection = connection_type(proxy.hostname, proxy.port or 80, timeout = self.timeout)
+
+		if scheme == 'https':
+			connection.set_tunnel(hostname, port)
+
+		return connection
+
+	def _proxy(self, scheme, hostname):
+
+		proxy = self.proxies.get(scheme)
+
+		if proxy is None or proxy_bypass(hostname):
+			return None
+
+		return proxy
+
+class PewResponseStream(object):
+
+	def __init__(self, pool, host, connection, response):
+
+		self._pool = pool
+		self._host = host
+		self._connection = connection
+		self._response = response
+		self._encoding = response.getheader('content-encoding')
+		self._decoder = None
+		self._eof = False
+
+	def read(self, size = -1):
+
+		if self._eof:
+			return ''
+
+		try:
+			while True:
+				data = self._response.read() if size < 0 else self._response.read(size)
+
+				if not data:
+					self._eof = True
+					return self._decoder.flush() if self._decoder is not None else ''
+
+				if self._encoding not in ('gzip', 'deflate'):
+					return data
+
+				if self._decoder is None:
+					self._decoder = self._create_decoder(data)
+
+				data = self._decoder.decompress(data)
+
+				if data or size < 0:
+					return data
+
+		except (socket.error, httplib.HTTPException, zlib.error) as er:
+			raise PewConnectionError(str(er))
+
+	def close(self):
+
+		connection, self._connection = self._connection, None
+
+		if connection is None:
+			return
+
+		# Only a fully read response leaves the connection in a reusable state.
+		if self._response.isclosed() and not self._response.will_close:
+			self._pool._release(self._host, connection)
+		else:
+			self._pool._discard(self._host, connection)
+
+	def _create_decoder(self, data):
+
+		if self._encoding == 'gzip':
+			return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+		# Some servers send raw deflate data without the zlib header.
+		if len(data) >= 2 and (ord(data[0]) & 0x0f != 8 or (ord(data[0]) << 8 | ord(data[1])) % 31):
+			return zlib.decompressobj(-zlib.MAX_WBITS)
+
+		return zlib.decompressobj()
+
+class PewFuture(object):
+
+	def __init__(self, client):
+
+		self._client = client
+		self._done = False
+		self._result = None
+		self._error = None
+		self._callbacks = []
+
+	def done(self):
+		return self._done
+
+	def result(self):
+
+		if not self._done:
+			self._client.run_until(self)
+
+		if self._error is not None:
+			raise self._error
+
+		return self._result
+
+	def add_callback(self, callback):
+
+		if self._done:
+			callback(self)
+		else:
+			self._callbacks.append(callback)
+
+	def _set(self, result = None, error = None):
+
+		self._result = result
+		self._error = error
+		self._done = True
+
+		for callback in self._callbacks:
+			callback(self)
+
+		self._callbacks = []
+
+class _PewBufferSocket(object):
+
+	def __init__(self, data):
+		self._file = StringIO(data)
+
+	def makefile(self, *args, **kwargs):
+		return self._file
+
+class _PewAsyncRequest(asyncore.dispatcher):
+
+	_PORTS = {'http': 80, 'https': 443}
+	_ADDRESS_TTL = 300
+	_addresses = {}
+
+	def __init__(self, url, timeout, callback, socket_map):
+
+		asyncore.dispatcher.__init__(self, map = socket_map)
+
+		parts = urlsplit(url)
+		path = parts.path
+
+		if parts.query:
+			path = '%s?%s' % (path, parts.query)
+
+		self.deadline = time.time() + timeout
+		self._callback = callback
+		self._hostname = parts.hostname
+		self._secure = parts.scheme == 'https'
+		self._handshaking = False
+		self._want_write = False
+		self._out = 'GET %s HTTP/1.1\r\nHost: %s\r\nAccept-Encoding: gzip, deflate\r\nConnection: close\r\n\r\n' % (path, parts.netloc)
+		self._in = []
+
+		if parts.scheme not in self._PORTS:
+			self.fail(PewConnectionError('unsupported url scheme: %s' % parts.scheme))
+			return
+
+		self._host = (parts.hostname, parts.port or self._PORTS[parts.scheme])
+
+		try:
+			self._candidates = self._resolve(self._host)
+		except socket.error as er:
+			self.fail(PewConnectionError(str(er)))
+			return
+
+		self._connect_next(None)
+
+	@classmethod
+	def _resolve(cls, host):
+
+		# Lookups block the loop thread, so results are reused for a while. The family comes
+		# from each result, which lets IPv6-only hosts connect too.
+		entry = cls._addresses.get(host)
+
+		if entry is None or entry[0] <= time.time():
+			results = socket.getaddrinfo(host[0], host[1], 0, socket.SOCK_STREAM)
+			entry = (time.time() + cls._ADDRESS_TTL, [(result[0], result[4]) for result in results])
+			cls._addresses[host] = entry
+
+		return list(entry[1])
+
+	def _connect_next(self, error):
+
+		# Each address is tried in turn. Once all of them fail the lookup is dropped, so the
+		# next request resolves the host again.
+		while self._candidates:
+			family, address = self._candidates.pop(0)
+
+			if self.socket is not None:
+				self.close()
+
+			try:
+				self.create_socket(family, socket.SOCK_STREAM)
+				self.connect(address)
+				return
+			except socket.error as er:
+				error = er
+
+		self._addresses.pop(self._host, None)
+		self.fail(PewConnectionError(str(error)))
+
+	def fail(self, error):
+
+		if self.socket is not None:
+			self.close()
+
+		callback, self._callback = self._callback, None
+
+		if callback is not None:
+			callback(None, error)
+
+	def writable(self):
+		return not self.connected or bool(self._out) or (self._handshaking and self._want_write)
+
+	def handle_connect(self):
+
+		entry = self._addresses.get(self._host)
+
+		# Later requests start with the address that worked.
+		if entry is not None and entry[1][0][1] != self.addr:
+			entry[1].sort(key = lambda candidate: candidate[1] != self.addr)
+
+		if not self._secure:
+			return
+
+		context = ssl.create_default_context()
+		sock = context.wrap_socket(self.socket, server_hostname = self._hostname, do_handshake_on_connect = False)
+
+		self.del_channel()
+		self.set_socket(sock)
+		self._handshaking = True
+		self._handshake()
+
+	def handle_read(self):
+
+		if self._handshaking:
+			self._handshake()
+			return
+
+		try:
+			while True:
+				data = self.socket.recv(65536)
+
+				if not data:
+					self._finish()
+					return
+
+				self._in.append(data)
+
+				# Decrypted bytes buffered inside the SSL object are invisible to poll.
+				if not self._secure or not self.socket.pending():
+					return
+
+		except ssl.SSLWantReadError:
+			pass
+
+	def handle_write(self):
+
+		if self._handshaking:
+			self._handshake()
+			return
+
+		try:
+			sent = self.socket.send(self._out)
+			self._out = self._out[sent:]
+		except (ssl.SSLWantReadError, ssl.SSLWantWriteError):
+			pass
+
+	def handle_close(self):
+
+		if self.connecting:
+			self._connect_next(PewConnectionError('connection closed'))
+		else:
+			self._finish()
+
+	def handle_error(self):
+
+		if self.connecting:
+			self._connect_next(sys.exc_info()[1])
+			return
+
+		# Servers often drop SSL connections without a close_notify once the response is
+		# sent; anything already received is parsed, and truncation is caught there.
+		if self._in and not self._out:
+			self._finish()
+		else:
+			self.fail(PewConnectionError(str(sys.exc_info()[1])))
+
+	def _handshake(self):
+
+		try:
+			self.socket.do_handshake()
+			self._handshaking = False
+		except ssl.SSLWantReadError:
+			self._want_write = False
+		except ssl.SSLWantWriteError:
+			self._want_write = True
+
+	def _finish(self):
+
+		self.close()
+		callback, self._callback = self._callback, None
+
+		if callback is None:
+			return
+
+		try:
+			response = httplib.HTTPResponse(_PewBufferSocket(''.join(self._in)))
+			response.begin()
+			body = response.read()
+
+			if response.status != 200:
+				raise PewConnectionError('HTTP Error %d: %s' % (response.status, response.reason))
+
+			body = _decode_body(body, response.getheader('content-encoding'))
+
+		except httplib.HTTPException as er:
+			callback(None, PewConnectionError(str(er)))
+		except PewConnectionError as er:
+			callback(None, er)
+		else:
+			callback(body, None)
+
+class PewBatchResult(object):
+
+	def __init__(self, job, result = None, error = None):
+
+		self.job = job
+		self.result = result
+		self.error = error
+
+class PewParseMemo(object):
+
+	_TIMES = re.compile(r'<(currentTime|cachedUntil)>([^<]*)</\1>')
+
+	def __init__(self, max_entries = 256, deep_copy = False):
+
+		self.deep_copy = deep_copy
+		self.hits = 0
+		self.misses = 0
+		self._entries = PewMemoryCache(max_entries)
+		self._lock = threading.Lock()
+
+	def key(self, xml, *variant):
+
+		# Bodies that differ only in their envelope timestamps share a key.
+		digest = hashlib.sha1(self._TIMES.sub('', xml)).digest()
+		return (digest,) + variant, dict(self._TIMES.findall(xml))
+
+	def get(self, key, times):
+
+		envelope = self._entries.get(key)
+
+		with self._lock:
+			if envelope is None:
+				self.misses += 1
+			else:
+				self.hits += 1
+
+		if envelope is None:
+			return None
+
+		return self._copy(envelope, times)
+
+	def set(self, key, envelope, times):
+
+		self._entries.set(key, envelope, float('inf'))
+		return self._copy(envelope, times)
+
+	def clear(self):
+		self._entries.clear()
+
+	def _copy(self, envelope, times):
+
+		# Every caller gets its own envelope and result to stamp; rows and nested
+		# objects below them are shared unless deep copies were asked for.
+		copied = copy.copy(envelope)
+		copied.result = copy.deepcopy(envelope.result) if self.deep_copy else copy.copy(envelope.result)
+
+		for tag, value in times.items():
+			setattr(copied, tag, value)
+
+		return copied
+
+class PewParsePool(object):
+
+	def __init__(self, processes = None, threshold = 1048576):
+
+		self.threshold = threshold
+		self._pool = Pool(processes)
+
+	def parse(self, xml, xml_backend = 'etree', mode = None, use_numpy = False):
+		return self._pool.apply(_parse_worker, (xml, xml_backend, mode, use_numpy))
+
+	def close(self):
+
+		self._pool.close()
+		self._pool.join()
+
+def _parse_worker(xml, xml_backend, mode, use_numpy):
+
+	pew = Pew()
+	pew.xml_backend = xml_backend
+	pew._mode = mode
+	pew._use_numpy = use_numpy
+
+	return pew._parse_xml(xml)
+
+def _decode_body(body, encoding):
+
+	try:
+		if encoding == 'gzip':
+			return zlib.decompress(body, 16 + zlib.MAX_WBITS)
+
+		if encoding == 'deflate':
+			try:
+				return zlib.decompress(body)
+			except zlib.error:
+				return zlib.decompress(body, -zlib.MAX_WBITS)
+
+	except zlib.error as er:
+		raise PewConnectionError(str(er))
+
+	return body
+
+def _write_atomic(path, data):
+
+	# Data is written to a temporary file and renamed into place, so concurrent readers in
+	# other processes never see a partial file.
+	fd, temp_path = tempfile.mkstemp(prefix = '.', dir = os.path.dirname(path) or '.')
+
+	try:
+		with os.fdopen(fd, 'wb') as f:
+			f.write(data)
+
+		try:
+			os.rename(temp_path, path)
+		except OSError:
+			# Windows will not rename over an existing file.
+			_remove_file(path)
+			os.rename(temp_path, path)
+
+	except EnvironmentError:
+		_remove_file(temp_path)
+		raise
+
+def _makedirs(path):
+
+	try:
+		os.makedirs(path)
+	except OSError as er:
+		if er.errno != errno.EEXIST:
+			raise
+
+def _remove_file(path):
+
+	try:
+		os.remove(path)
+	except OSError:
+		pass
+
 class PewError(Exception):
 
-	def __init__(self, error):
-		super(PewError, self).__init__()
+	def __init__(self, error):
+		super(PewError, self).__init__()
+
+		self.error = error
+
+	def __str__(self):
+		return repr(self.error)
+
+class PewApiError(PewError):
+
+	def __init__(self, code, error):
+		super(PewApiError, self).__init__(error)
+
+		self.code = code
+
+	def __str__(self):
+		return repr(self)
+
+	def __repr__(self):
+		return '[%s] %s' % (self.code, self.error)
+
+class PewConnectionError(PewError):
+
+	def __init__(self, error):
+		super(PewConnectionError, self).__init__(error)
+
+class Pew(object):
+
+	_CORP_TYPE = 'corp'
+	_CHAR_TYPE = 'char'
+	_ACCT_TYPE = 'account'
+	_MAPS_TYPE = 'map'
+	_EVE_TYPE = 'eve'
+
+	_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+	_MAX_ROW_COUNT = 2560
+
+	# Server-side database failures and rate limiting; a temporary IP block (904) is not
+	# retried since further requests only extend it.
+	_RETRYABLE_CODES = (520, 901, 902, 903)
+
+	_ID_LIST_LIMITS = {
+		'calendarEventAttendees': 100,
+		'characterid': 250,
+		'charactername': 250,
+		'mailbodies': 100,
+		'notificationtexts': 100,
+	}
+
+	_HOOK_EVENTS = ('request', 'response', 'parse', 'error', 'cache', 'shared')
+
+	_ROWSETS = {
+		'char_wallet_journal': 'entries',
+		'char_wallet_transactions': 'transactions',
+		'corp_wallet_journal': 'entries',
+		'corp_wallet_transactions': 'transactions',
+		'char_mail_messages': 'messages',
+		'char_notifications': 'notifications',
+	}
+
+	_PAGED_METHODS = {
+		'char_wallet_journal': 'refID',
+		'char_wallet_transactions': 'transactionID',
+		'corp_wallet_journal': 'refID',
+		'corp_wallet_transactions': 'transactionID',
+	}
+
+	def __init__(self, api_id = None, api_key = None, cache = None, pool = None, limiter = None, error_budget = None, parse_pool = None, parse_memo = None):
+
+		self.api_id = api_id
+		self.api_key = api_key
+		self.api_url = 'https://api.eveonline.com'
+		self.cache = cache
+		self.pool = pool if pool is not None else PewConnectionPool()
+		self.limiter = limiter
+		self.error_budget = error_budget
+		self.parse_pool = parse_pool
+		self.parse_memo = parse_memo
+		self.retries = 0
+		self.backoff = 0.5
+		self.max_backoff = 30
+		self.coalesce_window = 0
+		self.chunk_workers = 4
+		self._stream_rowset = None
+		self._mode = None
+		self._use_numpy = False
+		self._lookups = PewMemoryCache(max_entries = 100000)
+		self._coalescing = {}
+		self._coalescing_lock = threading.Lock()
+		self._hooks = {}
+		self._flights = {}
+		self._flights_lock = threading.Lock()
+		self.xml_backend = 'etree'
+
+	# Hook methods.
+
+	def add_hook(self, event, hook):
+
+		if event not in self._HOOK_EVENTS:
+			raise ValueError('unknown hook event: %s' % event)
+
+		# Lists are replaced rather than appended to, so requests in flight on other
+		# threads iterate a stable copy.
+		self._hooks[event] = self._hooks.get(event, []) + [hook]
+
+	def remove_hook(self, event, hook):
+
+		hooks = [h for h in self._hooks.get(event, []) if h != hook]
+
+		if hooks:
+			self._hooks[event] = hooks
+		else:
+			self._hooks.pop(event, None)
+
+	def _emit(self, event, info):
+
+		for hook in self._hooks.get(event, ()):
+			hook(info)
+
+	def _request_info(self, api_type, method_name, url):
+
+		if not self._hooks:
+			return None
+
+		return {'api_type': api_type, 'method_name': method_name, 'url': url}
+
+	# Request methods.
+
+	def _char_request(self, api_type, method_name, character_id, params = None):
+
+		params = dict(params or {})
+		params['characterId'] = character_id
+
+		return self._auth_request(api_type, method_name, params)
+
+	def _auth_request(self, api_type, method_name, params = None):
+
+		params = dict(params or {})
+		params['keyId'] = self.api_id
+		params['vCode'] = self.api_key
+
+		return self._request(api_type, method_name, params)
+
+	def _request(self, api_type, method_name, params = None):
+
+		params = params or {}
+		url = self._build_url(api_type, method_name, params)
+		key = self._cache_key(api_type, method_name, params)
+		info = self._request_info(api_type, method_name, url)
+
+		if self._stream_rowset is not None:
+			return self._stream_request(url, self._stream_rowset, info)
+
+		if self.cache is not None:
+			result = self.cache.get(key)
+
+			if result is not None:
+				if info is not None:
+					info['result'] = result
+					self._emit('cache', info)
+
+				return result
+
+		return self._single_flight(key, lambda: self._fetch_and_cache(key, url, info), info)
+
+	def _fetch_and_cache(self, key, url, info):
+
+		result = self._fetch(url, info)
+
+		if self.cache is not None and getattr(result, '_expires', None) is not None:
+			self.cache.set(key, result, result._expires)
+
+		return result
+
+	def _single_flight(self, key, fetch, info = None):
+
+		with self._flights_lock:
+			flight = self._flights.get(key)
+			leader = flight is None
+
+			if leader:
+				flight = {'done': threading.Event()}
+				self._flights[key] = flight
+
+		# Identical requests arriving while one is in flight wait for it and share its
+		# result or error instead of sending their own.
+		if not leader:
+			flight['done'].wait()
+
+			if info is not None:
+				info.update((name, flight[name]) for name in ('result', 'error') if name in flight)
+				self._emit('shared', info)
+
+			if 'error' in flight:
+				raise flight['error']
+
+			return flight['result']
+
+		try:
+			flight['result'] = fetch()
+			return flight['result']
+		except Exception as er:
+			flight['error'] = er
+			raise
+		finally:
+			with self._flights_lock:
+				del self._flights[key]
+
+			flight['done'].set()
+
+	def _fetch(self, url, info = None):
+
+		attempt = 0
+
+		while True:
+			self._throttle()
+
+			try:
+				if info is None:
+					return self._handle_result(self._raw_request(url))
+
+				return self._instrumented_fetch(url, info)
+
+			except (PewApiError, PewConnectionError) as er:
+				if self.error_budget is not None:
+					self.error_budget.record(self.api_id)
+
+				if info is not None:
+					info['error'] = er
+					self._emit('error', info)
+
+				if attempt >= self.retries or not self._is_retryable(er):
+					raise
+
+			self._backoff(attempt)
+			attempt += 1
+
+	def _throttle(self):
+
+		if self.error_budget is not None:
+			self.error_budget.wait(self.api_id)
+
+		if self.limiter is not None:
+			self.limiter.acquire()
+
+	def _throttle_delay(self):
+
+		# The non-blocking form of _throttle, for the event loop: a token is only taken
+		# once the error budget allows a request.
+		if self.error_budget is not None:
+			delay = self.error_budget.delay(self.api_id)
+
+			if delay > 0:
+				return delay
+
+		if self.limiter is not None:
+			return self.limiter._reserve(1)
+
+		return 0
+
+	def _backoff(self, attempt):
+		time.sleep(self._backoff_delay(attempt))
+
+	def _backoff_delay(self, attempt):
+
+		# Full jitter keeps many clients that failed together from retrying together.
+		return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+	def _is_retryable(self, error):
+
+		if isinstance(error, PewApiError):
+			return error.code in self._RETRYABLE_CODES
+
+		return True
+
+	def _instrumented_fetch(self, url, info):
+
+		info['attempt'] = info.get('attempt', -1) + 1
+		self._emit('request', info)
+		body = self._raw_request(url, info)
+		self._emit('response', info)
+
+		start = time.time()
+
+		try:
+			result = self._handle_result(body)
+		finally:
+			info['parse'] = time.time() - start
+
+		info['result'] = result
+		self._emit('parse', info)
+
+		return result
+
+	def _raw_request(self, url, timing = None):
+		return self.pool.request(url, timing)
+
+	def _stream_request(self, url, rowset, info = None):
+
+		attempt = 0
+
+		while True:
+			self._throttle()
+			rows = 0
+
+			try:
+				if info is not None:
+					info['attempt'] = attempt
+					self._emit('request', info)
+
+				stream = self.pool.open(url, info)
+
+				if info is not None:
+					self._emit('response', info)
+					start = time.time()
+
+				try:
+					for row in self._iter_rowset(stream, rowset):
+						rows += 1
+						yield row
+				finally:
+					stream.close()
+
+				if info is not None:
+					# The body is read and parsed together, so all of it counts as parse time.
+					info['parse'] = time.time() - start
+					info['rows'] = rows
+					self._emit('parse', info)
+
+				return
+
+			except (PewApiError, PewConnectionError) as er:
+				if self.error_budget is not None:
+					self.error_budget.record(self.api_id)
+
+				if info is not None:
+					info['error'] = er
+					self._emit('error', info)
+
+				# Rows already handed out cannot be taken back, so only failures before
+				# the first row are retried.
+				if rows or attempt >= self.retries or not self._is_retryable(er):
+					raise
+
+			self._backoff(attempt)
+			attempt += 1
+
+	def _build_url(self, api_type, method_name, params = None):
+
+		url = '%s/%s/%s.xml.aspx' % (self.api_url, api_type, method_name)
+
+		if params:
+			url = '%s?%s' % (url, urlencode(params))
+
+		return url
+
+	def _cache_key(self, api_type, method_name, params):
+		return (api_type, method_name, tuple(sorted(params.items())), self._mode, self._use_numpy)
+
+	# Result handling methods.
+
+	def _parse_xml(self, xml):
+
+		# The C ElementTree builds its tree faster than expat callbacks can build results,
+		# but the expat builder never holds a whole tree. Lazy and columnar results always
+		# work on element trees.
+		if self.xml_backend == 'expat' and expat is not None and self._mode is None:
+			return _PewExpatBuilder(self).parse(xml)
+
+		tree = ElementTree.fromstring(xml)
+
+		if self._mode == 'lazy':
+			return self._lazy_xml(tree)
+
+		return self._r_parse_xml(tree)[0]
+
+	def _lazy_xml(self, node):
+
+		if node.tag != 'rowset' and (len(node) > 0 or len(node.items()) > 0):
+			return PewLazyObject(self, node)
+
+		return self._r_parse_xml(node)[0]
+
+	def _r_parse_xml(self, node, obj_type = PewApiObject):
+
+		has_value = node.text is not None and len(node.text.strip()) > 0
+
+		if node.tag == 'rowset':
+			if self._mode == 'columnar' and node.get('columns') is not None:
+				columns = self._parse_columns(node)
+
+				if columns is not None:
+					return columns, node.get('name')
+
+			row_type = self._row_type(node)
+			return [self._r_parse_xml(child, row_type)[0] for child in node], node.get('name')
+
+		if len(node) > 0 or len(node.items()) > 0:
+
+			obj = obj_type()
+			converters = getattr(obj_type, '_converters', _COLUMN_TYPES)
+
+			for attr, value in node.items():
+				setattr(obj, attr, self._convert_value(converters.get(attr), value))
+
+			for child in node:
+				child_obj, child_tag = self._r_parse_xml(child)
+				setattr(obj, child_tag, child_obj)
+
+			if has_value:
+				setattr(obj, '_value', node.text)
+
+			return obj, node.tag
+
+		elif has_value:
+			return self._convert_value(_COLUMN_TYPES.get(node.tag), node.text), node.tag
+		
+		return None, node.tag
+
+	def _iter_rowset(self, source, rowset):
+
+		depth = 0
+		target = None
+		target_node = None
+
+		for event, node in ElementTree.iterparse(source, events = ('start', 'end')):
+
+			if event == 'start':
+				depth += 1
+
+				if target is None and node.tag == 'rowset' and node.get('name') == rowset:
+					target = depth
+					target_node = node
+					row_type = self._row_type(node)
+
+				continue
+
+			if target_node is not None and depth == target + 1:
+				yield self._r_parse_xml(node, row_type)[0]
+
+				# Rows are dropped as soon as they are yielded, so only one is held at a time.
+				target_node.remove(node)
+
+			elif depth == 2 and node.tag == 'error':
+				raise PewApiError(int(node.get('code')), node.text)
+
+			elif target is None or depth <= target:
+				if node is target_node:
+					target_node = None
+
+				node.clear()
+
+			depth -= 1
+
+	def _parse_columns(self, node):
+
+		# Rows with nested rowsets do not fit a flat table.
+		for row in node:
+			if len(row) > 0:
+				return None
+
+		columns = [column.strip() for column in node.get('columns').split(',')]
+		converters = self._row_type(node)._converters
+		builders = [_PewColumnBuilder(converters.get(column)) for column in columns]
+		pairs = zip(columns, builders)
+
+		for row in node:
+			get = row.get
+
+			for column, builder in pairs:
+				builder.append(get(column))
+
+		return PewColumns(node.get('name'), OrderedDict((column, builder.finish(self._use_numpy)) for column, builder in pairs))
+
+	def _row_type(self, node):
+
+		columns = node.get('columns')
+
+		if columns is None:
+			return PewApiObject
+
+		return _row_type(node.get('name'), columns)
+
+	def _convert_value(self, converter, value):
+
+		if not value:
+			return value
+
+		if converter is None:
+			return self._parse_value(value)
+
+		try:
+			return converter(value)
+		except (ValueError, ArithmeticError):
+			return self._parse_value(value)
+
+	def _parse_value(self, value):
+		try:
+			return int(value)
+		except ValueError:
+			return value
+
+	def _handle_result(self, xml):
+
+		memo = self.parse_memo
 
-		self.error = error
+		# Lazy results keep materializing into their own objects, so they are not shared.
+		if memo is not None and self._mode != 'lazy':
+			key, times = memo.key(xml, self._mode, self._use_numpy)
+			result = memo.get(key, times)
 
-	def __str__(self):
-		return repr(self.error)
+			if result is None:
+				result = self._parse_result(xml)
 
-class PewApiError(PewError):
+				if not hasattr(result, 'error'):
+					result = memo.set(key, result, times)
+		else:
+			result = self._parse_result(xml)
 
-	def __init__(self, code, error):
-		super(PewApiError, self).__init__(error)
+		if hasattr(result, 'error'):
+			raise PewApiError(int(result.error.code), result.error._value)
 
-		self.code = code
+		return self._stamp_result(result)
 
-	def __str__(self):
-		return repr(self)
+	def _parse_result(self, xml):
 
-	def __repr__(self):
-		return '[%s] %s' % (self.code, self.error)
+		# Large bodies are parsed in another process and come back as pickled rows;
+		# lazy results hold element trees and cannot be sent back.
+		if self.parse_pool is not None and len(xml) >= self.parse_pool.threshold and self._mode != 'lazy':
+			return self.parse_pool.parse(xml, self.xml_backend, self._mode, self._use_numpy)
 
-class PewConnectionError(PewError):
+		return self._parse_xml(xml)
 
-	def __init__(self, error):
-		super(PewConnectionError, self).__init__(error)
+	def _stamp_result(self, envelope):
 
-class Pew(object):
+		result = envelope.result
 
-	_CORP_TYPE = 'corp'
-	_CHAR_TYPE = 'char'
-	_ACCT_TYPE = 'account'
-	_MAPS_TYPE = 'map'
-	_EVE_TYPE = 'eve'
+		if not isinstance(result, PewApiObject):
+			return result
 
-	def __init__(self, api_id = None, api_key = None):
+		result._current_time = self._parse_time(getattr(envelope, 'currentTime', None))
+		result._cached_until = self._parse_time(getattr(envelope, 'cachedUntil', None))
+		result._expires = None
 
-		self.api_id = api_id
-		self.api_key = api_key
-		self.api_url = 'https://api.eveonline.com'
-		self._params = {}
+		# Expiry is computed from the server's own clock so local skew does not matter.
+		if result._current_time is not None and result._cached_until is not None:
+			lifetime = (result._cached_until - result._current_time).total_seconds()
+			result._expires = time.time() + lifetime
 
-	# Request methods.
+		return result
 
-	def _char_request(self, api_type, method_name, character_id):
+	def _parse_time(self, value):
 
-		self._params['characterId'] = character_id
+		if isinstance(value, datetime):
+			return value
 
-		return self._auth_request(api_type, method_name)
+		try:
+			return datetime.strptime(value, self._TIME_FORMAT)
+		except (TypeError, ValueError):
+			return None
 
-	def _auth_request(self, api_type, method_name):
+	# Variant methods.
 
-		self._params['keyId'] = self.api_id
-		self._params['vCode'] = self.api_key
+	def streaming(self, rowset):
+		return self._clone(_stream_rowset = rowset)
 
-		return self._request(api_type, method_name)
+	def lazy(self):
+		return self._clone(_mode = 'lazy')
 
-	def _request(self, api_type, method_name):
+	def columnar(self, use_numpy = True):
+		return self._clone(_mode = 'columnar', _use_numpy = use_numpy and numpy is not None)
 
-		url = self._build_url(api_type, method_name)
-		self._params.clear()
+	def _clone(self, **attributes):
 
-		result = self._raw_request(url)
+		clone = copy.copy(self)
+		clone.__dict__.update(attributes)
 
-		return self._handle_result(result)
+		return clone
 
-	def _raw_request(self, url):
+	# Batch methods.
 
-		try:
-			response = urlopen(url)
-			result = response.read()
+	def batch(self, jobs, workers = 8, key_limit = 4):
 
-			return result
+		queues = OrderedDict()
 
-		except URLError as er:
-			raise PewConnectionError(str(er))
+		for job in jobs:
+			method = getattr(self, job[0]) if isinstance(job[0], basestring) else job[0]
+			key = getattr(method, '__self__', self).api_id
+			queues.setdefault(key, deque()).append((job, method))
 
-	def _build_url(self, api_type, method_name):
+		running = dict.fromkeys(queues, 0)
+		remaining = sum(len(queue) for queue in queues.values())
+		results = Queue.Queue()
+		pool = ThreadPool(workers)
 
-		url = '%s/%s/%s.xml.aspx' % (self.api_url, api_type, method_name)
+		try:
+			self._batch_dispatch(pool, queues, running, key_limit, results)
 
-		if len(self._params) > 0:
-			url = '%s?%s' % (url, urlencode(self._params))
+			while remaining > 0:
+				key, result, unexpected = results.get()
+				running[key] -= 1
+				remaining -= 1
 
-		return url
+				if unexpected is not None:
+					raise unexpected
 
-	# Result handling methods.
+				self._batch_dispatch(pool, queues, running, key_limit, results)
 
-	def _parse_xml(self, xml):
+				yield result
 
-		tree = ElementTree.fromstring(xml)
+		finally:
+			pool.terminate()
 
-		return self._r_parse_xml(tree)[0]
+	def _batch_dispatch(self, pool, queues, running, key_limit, results):
 
-	def _r_parse_xml(self, node):
+		# Jobs are only handed to the pool while their key is under its limit, so a
+		# large batch for one key cannot tie up every worker.
+		for key, queue in queues.items():
+			while queue and running[key] < key_limit:
+				job, method = queue.popleft()
+				running[key] += 1
+				pool.apply_async(self._batch_run, (key, job, method, results))
 
-		has_value = node.text is not None and len(node.text.strip()) > 0
+	def _batch_run(self, key, job, method, results):
 
-		if node.tag == 'rowset':
-			return [self._r_parse_xml(child)[0] for child in node], node.get('name')
+		try:
+			kwargs = job[1] if len(job) > 1 and job[1] is not None else {}
+			results.put((key, PewBatchResult(job, result = method(**kwargs)), None))
+		except PewError as er:
+			results.put((key, PewBatchResult(job, error = er), None))
+		except Exception as er:
+			results.put((key, None, er))
 
-		if len(node) > 0 or len(node.items()) > 0:
+	# ID list methods.
 
-			obj = PewApiObject()
+	def _id_list_request(self, api_type, method_name, param, ids, character_id = None, match_column = None):
 
-			for attr, value in node.items():
-				setattr(obj, attr, self._parse_value(value))
+		ids = self._unique(ids)
 
-			for child in node:
-				child_obj, child_tag = self._r_parse_xml(child)
-				setattr(obj, child_tag, child_obj)
+		if self.coalesce_window <= 0:
+			return self._chunked_request(api_type, method_name, param, ids, character_id)
 
-			if has_value:
-				setattr(obj, '_value', node.text)
+		key = (api_type, method_name, character_id, self._mode)
+		send = lambda all_ids: self._chunked_request(api_type, method_name, param, self._unique(all_ids), character_id)
+		result = self._coalesce(key, ids, send)
 
-			return obj, node.tag
+		return self._filter_rows(result, match_column, ids) if match_column is not None else result
 
-		elif has_value:
-			return self._parse_value(node.text), node.tag
-		
-		return None, node.tag
+	def _chunked_request(self, api_type, method_name, param, ids, character_id):
+
+		chunks = self._chunks(method_name, ids)
+		request = lambda chunk: self._id_chunk_request(api_type, method_name, param, chunk, character_id)
+
+		if len(chunks) == 1:
+			return request(chunks[0])
+
+		pool = ThreadPool(min(self.chunk_workers, len(chunks)))
 
-	def _parse_value(self, value):
 		try:
-			return int(value)
-		except ValueError:
-			return value
+			results = pool.map(request, chunks)
+		finally:
+			pool.terminate()
 
-	def _handle_result(self, xml):
+		return self._merge_results(results)
 
-		result = self._parse_xml(xml)
+	def _chunks(self, method_name, ids):
 
-		if hasattr(result, 'error'):
-			raise PewApiError(int(result.error.code), result.error._value)
+		limit = self._ID_LIST_LIMITS.get(method_name) or max(len(ids), 1)
+		return [ids[i:i + limit] for i in range(0, len(ids), limit)] or [[]]
+
+	def _id_chunk_request(self, api_type, method_name, param, ids, character_id):
+
+		params = {param: self._join(ids)}
+
+		if character_id is None:
+			return self._request(api_type, method_name, params)
+
+		return self._char_request(api_type, method_name, character_id, params)
+
+	def _coalesce(self, key, ids, send):
+
+		with self._coalescing_lock:
+			batch = self._coalescing.get(key)
+			leader = batch is None
+
+			if leader:
+				batch = {'ids': [], 'done': threading.Event()}
+				self._coalescing[key] = batch
+
+			batch['ids'].extend(ids)
+
+		# The first caller waits out the window, then sends every ID collected meanwhile
+		# in one request on behalf of all callers.
+		if leader:
+			time.sleep(self.coalesce_window)
+
+			with self._coalescing_lock:
+				del self._coalescing[key]
+
+			try:
+				batch['result'] = send(batch['ids'])
+			except Exception as er:
+				batch['error'] = er
+
+			batch['done'].set()
+
+		else:
+			batch['done'].wait()
+
+		if 'error' in batch:
+			raise batch['error']
+
+		return batch['result']
+
+	def _lookup_request(self, method_name, param, values, key_column, value_column):
+
+		values = self._unique(values)
+		missing = [value for value in values if self._lookups.get((method_name, self._id_key(value))) is None]
+		result = None
+
+		if missing:
+			# Memoized lookups are kept as rows, so they are always fetched eagerly and
+			# converted to the requested mode afterwards.
+			eager = self._clone(_mode = None) if self._mode is not None else self
+			result = eager._id_list_request(self._EVE_TYPE, method_name, param, missing, None, key_column)
+
+		return self._lookup_result(method_name, values, key_column, value_column, result)
+
+	def _lookup_result(self, method_name, values, key_column, value_column, result):
+
+		fetched = {}
+
+		if result is not None:
+			for row in getattr(result, 'characters', []):
+				row_key = self._id_key(getattr(row, key_column, ''))
+				fetched[row_key] = row
+
+				if getattr(row, value_column, None):
+					self._lookups.set((method_name, row_key), row, float('inf'))
+
+			result = copy.copy(result)
+
+		else:
+			result = PewApiObject()
+			result._current_time = result._cached_until = result._expires = None
+
+		result.characters = []
+
+		for value in values:
+			row = self._lookups.get((method_name, self._id_key(value))) or fetched.get(self._id_key(value))
+
+			if row is not None:
+				result.characters.append(row)
+
+		if self._mode == 'columnar':
+			result.characters = self._rows_to_columns('characters', result.characters, '%s,%s' % (key_column, value_column))
+
+		return result
+
+	def _rows_to_columns(self, name, rows, columns):
+
+		if rows and getattr(type(rows[0]), '_rowset', None) is not None:
+			columns = type(rows[0])._rowset[1]
+
+		columns = [column.strip() for column in columns.split(',')]
+		converters = _row_type(name, ','.join(columns))._converters
+		builders = [_PewColumnBuilder(converters.get(column)) for column in columns]
+
+		for row in rows:
+			for column, builder in zip(columns, builders):
+				builder.append(getattr(row, column, None))
+
+		return PewColumns(name, OrderedDict((column, builder.finish(self._use_numpy)) for column, builder in zip(columns, builders)))
+
+	def _rowset_names(self, result):
+
+		# Lazy results have not built their rowsets yet, so the names come from the tree.
+		if isinstance(result, PewLazyObject):
+			return [node.get('name') for node in result._node if node.tag == 'rowset']
+
+		return [name for name, value in vars(result).items() if isinstance(value, (list, PewColumns))]
+
+	def _merge_results(self, results):
+
+		merged = copy.copy(results[0])
+
+		for name in self._rowset_names(merged):
+			parts = [getattr(result, name) for result in results if hasattr(result, name)]
+
+			if isinstance(parts[0], PewColumns):
+				data = OrderedDict((column, self._concat_columns([part.data[column] for part in parts])) for column in parts[0].columns)
+				setattr(merged, name, PewColumns(parts[0].name, data))
+			else:
+				setattr(merged, name, list(itertools.chain.from_iterable(parts)))
+
+		expires = [result._expires for result in results if getattr(result, '_expires', None) is not None]
+		merged._expires = min(expires) if expires else None
+
+		return merged
+
+	def _concat_columns(self, parts):
+
+		if all(isinstance(part, array) and part.typecode == parts[0].typecode for part in parts):
+			merged = array(parts[0].typecode)
+
+			for part in parts:
+				merged.extend(part)
+
+			return merged
+
+		if numpy is not None and all(isinstance(part, numpy.ndarray) for part in parts):
+			return numpy.concatenate(parts)
+
+		return list(itertools.chain.from_iterable(parts))
+
+	def _filter_rows(self, result, match_column, ids):
+
+		wanted = set(self._id_key(i) for i in ids)
+		filtered = copy.copy(result)
+
+		for name in self._rowset_names(result):
+			value = getattr(result, name)
+
+			if isinstance(value, PewColumns):
+				keep = [i for i, key in enumerate(value.data.get(match_column, [])) if self._id_key(key) in wanted]
+				data = OrderedDict((column, self._take_column(value.data[column], keep)) for column in value.columns)
+				setattr(filtered, name, PewColumns(value.name, data))
+			else:
+				setattr(filtered, name, [row for row in value if self._id_key(getattr(row, match_column, '')) in wanted])
+
+		return filtered
+
+	def _take_column(self, column, indices):
+
+		if isinstance(column, array):
+			return array(column.typecode, [column[i] for i in indices])
+
+		if numpy is not None and isinstance(column, numpy.ndarray):
+			return column[numpy.array(indices, dtype = int)]
+
+		return [column[i] for i in indices]
+
+	def _unique(self, ids):
+
+		seen = set()
+		unique = []
+
+		for i in ids:
+			key = self._id_key(i)
+
+			if key not in seen:
+				seen.add(key)
+				unique.append(i)
 
-		return result.result
+		return unique
+
+	def _id_key(self, value):
+		return (u'%s' % value).lower()
+
+	# Paging methods.
+
+	def walk(self, method, character_id, account_key = None, prefetch = False):
+
+		name = method if isinstance(method, basestring) else method.__name__
+		self._require_rows('walk()')
+
+		return self._walk(name, character_id, account_key, prefetch)
+
+	def _walk(self, name, character_id, account_key, prefetch):
+
+		id_column = self._PAGED_METHODS[name]
+		method = getattr(self, name)
+
+		def fetch(from_id):
+			result = method(character_id, account_key = account_key, from_id = from_id, row_count = self._MAX_ROW_COUNT)
+			return self._page_rows(result, name)
+
+		rows = fetch(None)
+
+		while rows:
+			more = len(rows) >= self._MAX_ROW_COUNT
+			from_id = min(getattr(row, id_column) for row in rows)
+			next_rows = None
+
+			if more and prefetch:
+				next_rows = self._prefetch(fetch, from_id)
+
+			for row in rows:
+				yield row
+
+			if not more:
+				return
+
+			rows = next_rows() if next_rows is not None else fetch(from_id)
+
+	def _page_rows(self, result, method_name):
+		return getattr(result, self._ROWSETS[method_name])
+
+	def _require_blocking(self, name):
+		pass
+
+	def _require_rows(self, name):
+
+		self._require_blocking(name)
+
+		# Paging needs the ID column of every row, which streaming and columnar results
+		# do not provide.
+		if self._stream_rowset is not None or self._mode == 'columnar':
+			raise PewError('%s needs row results, not %s ones' % (name, 'streaming' if self._stream_rowset is not None else self._mode))
+
+	def _prefetch(self, fetch, from_id):
+
+		outcome = {}
+
+		def run():
+			try:
+				outcome['result'] = fetch(from_id)
+			except Exception as er:
+				outcome['error'] = er
+
+		thread = threading.Thread(target = run)
+		thread.daemon = True
+		thread.start()
+
+		def wait():
+			thread.join()
+
+			if 'error' in outcome:
+				raise outcome['error']
+
+			return outcome['result']
+
+		return wait
 
 	# Misc. methods.
 
 	def _join(self, lst):
-		return ','.join([str(i) for i in lst])
+		return ','.join([i if isinstance(i, basestring) else str(i) for i in lst])
+
+	def _wallet_params(self, account_key, from_id, row_count):
+
+		params = {}
+
+		if account_key is not None:
+			params['accountKey'] = account_key
+
+		if from_id is not None:
+			params['fromID'] = from_id
+
+		if row_count is not None:
+			params['rowCount'] = row_count
+
+		return params
 
 	# Account API methods.
 
@@ -203,8 +2963,7 @@ class Pew(object):
 		return self._char_request(self._CHAR_TYPE,'assetList', character_id)
 
 	def char_calendar_event_attendees(self, character_id, event_ids):
-		self._params['eventIds'] = self._join(event_ids)
-		return self._char_request(self._CHAR_TYPE,'calendarEventAttendees', character_id)
+		return self._id_list_request(self._CHAR_TYPE, 'calendarEventAttendees', 'eventIds', event_ids, character_id, 'eventID')
 
 	def char_character_sheet(self, character_id):
 		return self._char_request(self._CHAR_TYPE,'characterSheet', character_id)
@@ -228,8 +2987,7 @@ class Pew(object):
 		return self._char_request(self._CHAR_TYPE, 'mailinglists', character_id)
 
 	def char_mail_bodies(self, character_id, mail_ids):
-		self._params['ids'] = self._join(mail_ids)
-		return self._char_request(self._CHAR_TYPE, 'mailbodies', character_id)
+		return self._id_list_request(self._CHAR_TYPE, 'mailbodies', 'ids', mail_ids, character_id, 'messageID')
 
 	def char_mail_messages(self, character_id):
 		return self._char_request(self._CHAR_TYPE, 'mailmessages', character_id)
@@ -241,8 +2999,7 @@ class Pew(object):
 		return self._char_request(self._CHAR_TYPE, 'medals', character_id)
 
 	def char_notification_texts(self, character_id, notification_ids):
-		self._params['ids'] = self._join(notification_ids)
-		return self._char_request(self._CHAR_TYPE, 'notificationtexts', character_id)
+		return self._id_list_request(self._CHAR_TYPE, 'notificationtexts', 'ids', notification_ids, character_id, 'notificationID')
 
 	def char_notifications(self, character_id):
 		return self._char_request(self._CHAR_TYPE, 'notifications', character_id)
@@ -262,11 +3019,13 @@ class Pew(object):
 	def char_upcoming_calendar_events(self, character_id):
 		return self._char_request(self._CHAR_TYPE, 'upcomingcalendarevents', character_id)
 
-	def char_wallet_journal(self, character_id):
-		return self._char_request(self._CHAR_TYPE, 'walletjournal', character_id)
+	def char_wallet_journal(self, character_id, account_key = None, from_id = None, row_count = None):
+		params = self._wallet_params(account_key, from_id, row_count)
+		return self._char_request(self._CHAR_TYPE, 'walletjournal', character_id, params)
 
-	def char_wallet_transactions(self, character_id):
-		return self._char_request(self._CHAR_TYPE, 'wallettransactions', character_id)
+	def char_wallet_transactions(self, character_id, account_key = None, from_id = None, row_count = None):
+		params = self._wallet_params(account_key, from_id, row_count)
+		return self._char_request(self._CHAR_TYPE, 'wallettransactions', character_id, params)
 
 	# Corporation API methods.
 
@@ -322,8 +3081,8 @@ class Pew(object):
 		return self._char_request(self._CORP_TYPE, 'outpostservicedetail', character_id)
 
 	def corp_pos_detail(self, item_id):
-		self._params['itemID'] = item_id
-		return self._auth_request(self._CORP_TYPE, 'starbasedetail', item_id)
+		params = {'itemID': item_id}
+		return self._auth_request(self._CORP_TYPE, 'starbasedetail', params)
 
 	def corp_pos_list(self, character_id):
 		return self._char_request(self._CORP_TYPE, 'starbaselist', character_id)
@@ -334,11 +3093,13 @@ class Pew(object):
 	def corp_titles(self, character_id):
 		return self._char_request(self._CORP_TYPE, 'titles', character_id)
 
-	def corp_wallet_journal(self, character_id):
-		return self._char_request(self._CORP_TYPE, 'walletjournal', character_id)
+	def corp_wallet_journal(self, character_id, account_key = None, from_id = None, row_count = None):
+		params = self._wallet_params(account_key, from_id, row_count)
+		return self._char_request(self._CORP_TYPE, 'walletjournal', character_id, params)
 
-	def corp_wallet_transactions(self, character_id):
-		return self._char_request(self._CORP_TYPE, 'wallettransactions', character_id)
+	def corp_wallet_transactions(self, character_id, account_key = None, from_id = None, row_count = None):
+		params = self._wallet_params(account_key, from_id, row_count)
+		return self._char_request(self._CORP_TYPE, 'wallettransactions', character_id, params)
 
 	# Eve API methods.
 
@@ -349,15 +3110,13 @@ class Pew(object):
 		return self._request(self._EVE_TYPE, 'certificatetree')
 
 	def eve_character_id(self, character_names):
-		self._params['names'] = ''.join(character_names)
-		return self._request(self._EVE_TYPE, 'characterid')
+		return self._lookup_request('characterid', 'names', character_names, 'name', 'characterID')
 
 	def eve_character_info(self, character_id):
 		return self._char_request(self._EVE_TYPE, 'characterinfo', character_id)
 
 	def eve_character_name(self, character_ids):
-		self._params['ids'] = self._join(character_ids)
-		return self._request(self._EVE_TYPE, 'charactername')
+		return self._lookup_request('charactername', 'ids', character_ids, 'characterID', 'name')
 
 	def eve_conquerable_station_list(self):
 		return self._request(self._EVE_TYPE, 'conquerablestationlist')
@@ -394,4 +3153,287 @@ class Pew(object):
 	# Misc API methods.
 
 	def misc_server_status(self):
-		return self._request('server', 'serverstatus')
\ No newline at end of file
+		return self._request('server', 'serverstatus')
+
+class PewAsync(Pew):
+
+	def __init__(self, api_id = None, api_key = None, cache = None, max_connections = 256, timeout = 30, **kwargs):
+		super(PewAsync, self).__init__(api_id, api_key, cache, **kwargs)
+
+		self.max_connections = max_connections
+		self.timeout = timeout
+		self._map = {}
+		self._queued = deque()
+		self._delayed = []
+		self._sequence = itertools.count()
+		self._in_flight = {}
+
+	# ID list methods.
+
+	def _id_list_request(self, api_type, method_name, param, ids, character_id = None, match_column = None):
+
+		chunks = self._chunks(method_name, self._unique(ids))
+		futures = [self._id_chunk_request(api_type, method_name, param, chunk, character_id) for chunk in chunks]
+
+		if len(futures) == 1:
+			return futures[0]
+
+		return self._gather(futures, self._merge_results)
+
+	def _lookup_request(self, method_name, param, values, key_column, value_column):
+
+		values = self._unique(values)
+		missing = [value for value in values if self._lookups.get((method_name, self._id_key(value))) is None]
+
+		if not missing:
+			future = PewFuture(self)
+			future._set(self._lookup_result(method_name, values, key_column, value_column, None))
+			return future
+
+		eager = self._clone(_mode = None) if self._mode is not None else self
+		future = eager._id_list_request(self._EVE_TYPE, method_name, param, missing, None, key_column)
+
+		return self._gather([future], lambda results: self._lookup_result(method_name, values, key_column, value_column, results[0]))
+
+	def _gather(self, futures, combine):
+
+		gathered = PewFuture(self)
+		remaining = [len(futures)]
+
+		def complete(future):
+
+			remaining[0] -= 1
+
+			if remaining[0] > 0 or gathered.done():
+				return
+
+			errors = [f._error for f in futures if f._error is not None]
+
+			if errors:
+				gathered._set(error = errors[0])
+				return
+
+			try:
+				gathered._set(combine([f._result for f in futures]))
+			except Exception as er:
+				gathered._set(error = er)
+
+		for future in futures:
+			future.add_callback(complete)
+
+		return gathered
+
+	def streaming(self, rowset):
+		self._require_blocking('streaming()')
+
+	def batch(self, jobs, workers = 8, key_limit = 4):
+		self._require_blocking('batch()')
+
+	def _require_blocking(self, name):
+
+		# Methods return futures here, so callers that need results straight away cannot
+		# use this client.
+		raise PewError('%s needs a blocking client, not PewAsync' % name)
+
+	# Event loop methods.
+
+	def run(self):
+
+		while self._map or self._queued or self._delayed:
+			self._poll()
+
+	def run_until(self, future):
+
+		while not future.done() and (self._map or self._queued or self._delayed):
+			self._poll()
+
+	def wait(self, futures):
+
+		for future in futures:
+			self.run_until(future)
+
+		return futures
+
+	def _poll(self):
+
+		delay = self._start()
+
+		if self._map:
+			asyncore.loop(timeout = 0.05, use_poll = True, map = self._map, count = 1)
+		elif delay > 0:
+			time.sleep(min(delay, 0.05))
+
+		now = time.time()
+
+		for request in self._map.values():
+			if request.deadline < now:
+				request.fail(PewConnectionError('timed out'))
+
+	def _start(self):
+
+		now = time.time()
+
+		# Retries whose backoff has passed go ahead of new requests.
+		while self._delayed and self._delayed[0][0] <= now:
+			self._queued.appendleft(heapq.heappop(self._delayed)[2])
+
+		while self._queued and len(self._map) < self.max_connections:
+			# Queued requests wait for the limiter and error budget instead of blocking
+			# the loop; they are retried on the next poll.
+			delay = self._throttle_delay()
+
+			if delay > 0:
+				return delay
+
+			request = self._queued.popleft()
+			url, key, future, info, attempt = request
+			callback = lambda body, error, request = request: self._complete(request, body, error)
+
+			if info is not None:
+				info['attempt'] = attempt
+				info['start'] = time.time()
+				self._emit('request', info)
+
+			_PewAsyncRequest(url, self.timeout, callback, self._map)
+
+		return self._delayed[0][0] - now if self._delayed else 0
+
+	# Request methods.
+
+	def _request(self, api_type, method_name, params = None):
+
+		params = params or {}
+		url = self._build_url(api_type, method_name, params)
+		key = self._cache_key(api_type, method_name, params)
+		info = self._request_info(api_type, method_name, url)
+
+		if key in self._in_flight:
+			future = self._in_flight[key]
+
+			if info is not None:
+				future.add_callback(lambda future: self._shared(future, info))
+
+			return future
+
+		future = PewFuture(self)
+
+		if self.cache is not None:
+			result = self.cache.get(key)
+
+			if result is not None:
+				if info is not None:
+					info['result'] = result
+					self._emit('cache', info)
+
+				future._set(result)
+				return future
+
+		self._in_flight[key] = future
+		self._queued.append((url, key, future, info, 0))
+		self._start()
+
+		return future
+
+	def _complete(self, request, body, error):
+
+		url, key, future, info, attempt = request
+
+		if info is not None:
+			# Without blocking sockets the phases before the body arrives cannot be told
+			# apart, so all network time is reported as transfer.
+			info['transfer'] = time.time() - info.pop('start')
+
+			if error is None:
+				info['bytes'] = len(body)
+				self._emit('response', info)
+
+		if error is None:
+			start = time.time()
+
+			try:
+				result = self._handle_result(body)
+			except Exception as er:
+				error = er
+
+		if error is not None:
+			if attempt < self.retries and isinstance(error, (PewApiError, PewConnectionError)) and self._is_retryable(error):
+				self._report(error, info)
+				not_before = time.time() + self._backoff_delay(attempt)
+				heapq.heappush(self._delayed, (not_before, next(self._sequence), (url, key, future, info, attempt + 1)))
+				return
+
+			del self._in_flight[key]
+			self._fail(future, error, info)
+			return
+
+		del self._in_flight[key]
+
+		if info is not None:
+			info['parse'] = time.time() - start
+			info['result'] = result
+			self._emit('parse', info)
+
+		if self.cache is not None and getattr(result, '_expires', None) is not None:
+			self.cache.set(key, result, result._expires)
+
+		future._set(result)
+
+	def _shared(self, future, info):
+
+		if future._error is not None:
+			info['error'] = future._error
+		else:
+			info['result'] = future._result
+
+		self._emit('shared', info)
+
+	def _fail(self, future, error, info):
+
+		self._report(error, info)
+		future._set(error = error)
+
+	def _report(self, error, info):
+
+		if self.error_budget is not None and isinstance(error, (PewApiError, PewConnectionError)):
+			self.error_budget.record(self.api_id)
+
+		if info is not None:
+			info['error'] = error
+			self._emit('error', info)
+
+class PewSync(object):
+
+	_ID_COLUMNS = dict(Pew._PAGED_METHODS, char_mail_messages = 'messageID', char_notifications = 'notificationID')
+
+	def __init__(self, pew, store = None):
+
+		self.pew = pew
+		self.store = store if store is not None else PewMemorySyncStore()
+
+	def fetch(self, method_name, character_id, account_key = None):
+
+		self.pew._require_rows('PewSync')
+
+		id_column = self._ID_COLUMNS[method_name]
+		key = (self.pew.api_id, character_id, method_name, account_key)
+		mark = self.store.get(key)
+		rows = []
+
+		if method_name in Pew._PAGED_METHODS:
+			# Pages arrive newest first, so the first known row means everything after it
+			# is known too and no further pages are requested.
+			for row in self.pew.walk(method_name, character_id, account_key = account_key):
+				if mark is not None and getattr(row, id_column) <= mark:
+					break
+
+				rows.append(row)
+		else:
+			result = getattr(self.pew, method_name)(character_id)
+			rows = [row for row in self.pew._page_rows(result, method_name) if mark is None or getattr(row, id_column) > mark]
+
+		rows.sort(key = lambda row: getattr(row, id_column))
+
+		if rows:
+			self.store.set(key, getattr(rows[-1], id_column))
+
+		return rows
@@ -0,0 +1,323 @@
+import gc, json, optparse, resource, time
+
+from cStringIO import StringIO
+from multiprocessing import cpu_count, Pipe, Process
+from multiprocessing.pool import ThreadPool
+from urlparse import urlsplit
+
+import pew as pew_module
+
+from pew import Pew, PewParsePool, _row_type
+
+JOURNAL_COLUMNS = 'date,refID,refTypeID,ownerName1,ownerID1,ownerName2,ownerID2,argName1,argID1,amount,balance,reason,taxReceiverID,taxAmount'
+
+JOURNAL_ROW = [
+	('date', '2012-07-04 12:30:00'),
+	('refID', '5893465241'),
+	('refTypeID', '10'),
+	('ownerName1', 'Some Pilot'),
+	('ownerID1', '91399947'),
+	('ownerName2', 'Another Pilot'),
+	('ownerID2', '90000001'),
+	('argName1', ''),
+	('argID1', '0'),
+	('amount', '-150000000.00'),
+	('balance', '1234567890.12'),
+	('reason', 'DESC: for the ships'),
+	('taxReceiverID', ''),
+	('taxAmount', ''),
+]
+
+ASSET_COLUMNS = 'itemID,locationID,typeID,quantity,flag,singleton'
+
+RESULTS = []
+
+def envelope(result):
+	return '<?xml version="1.0" encoding="UTF-8"?><eveapi version="2"><currentTime>2012-07-04 12:00:00</currentTime><result>%s</result><cachedUntil>2012-07-04 13:00:00</cachedUntil></eveapi>' % result
+
+def character_sheet(skills = 20000):
+
+	skill_rows = ''.join('<row typeID="%d" skillpoints="%d" level="5" published="1"/>' % (i, i * 10) for i in range(skills))
+	certificate_rows = ''.join('<row certificateID="%d"/>' % i for i in range(skills // 4))
+
+	return envelope(
+		'<characterID>91399947</characterID><name>Some Pilot</name><balance>1234567890.12</balance>'
+		'<attributes><intelligence>20</intelligence><memory>20</memory></attributes>'
+		'<rowset name="skills" key="typeID" columns="typeID,skillpoints,level,published">%s</rowset>'
+		'<rowset name="certificates" key="certificateID" columns="certificateID">%s</rowset>' % (skill_rows, certificate_rows))
+
+def asset_list(rows, container_size = 20):
+
+	# Every container holds container_size items, so roughly one row in twenty is a
+	# container, as in typical hangar and ship asset lists.
+	items = []
+	item_id = 1000000000
+
+	while item_id - 1000000000 < rows:
+		location_id = 60000000 + item_id % 500
+		contents = ''.join('<row itemID="%d" typeID="%d" quantity="%d" flag="5" singleton="0"/>' % (item_id + i, 34 + i, i * 100) for i in range(1, container_size))
+
+		items.append('<row itemID="%d" locationID="%d" typeID="%d" quantity="1" flag="4" singleton="1"><rowset name="contents" key="itemID" columns="itemID,typeID,quantity,flag,singleton">%s</rowset></row>' %
+			(item_id, location_id, 587, contents))
+		item_id += container_size
+
+	return envelope('<rowset name="assets" key="itemID" columns="%s">%s</rowset>' % (ASSET_COLUMNS, ''.join(items)))
+
+def wallet_journal(rows):
+
+	row = ' '.join('%s="%%(%s)s"' % (attr, attr) for attr, value in JOURNAL_ROW)
+	values = dict(JOURNAL_ROW)
+	entries = []
+
+	for i in range(rows):
+		values['refID'] = 5893465241 - i
+		entries.append('<row %s/>' % (row % values))
+
+	return envelope('<rowset name="entries" key="refID" columns="%s">%s</rowset>' % (JOURNAL_COLUMNS, ''.join(entries)))
+
+def skill_tree(groups = 40, skills = 12):
+
+	rows = []
+
+	for group in range(groups):
+		group_id = 255 + group
+		skill_rows = ''.join(
+			'<row typeName="Skill %d" groupID="%d" typeID="%d" published="1"><description>Skill at operating things. %s</description><rank>%d</rank>'
+			'<rowset name="requiredSkills" key="typeID" columns="typeID,skillLevel"><row typeID="3300" skillLevel="3"/></rowset>'
+			'<requiredAttributes><primaryAttribute>perception</primaryAttribute><secondaryAttribute>willpower</secondaryAttribute></requiredAttributes>'
+			'<rowset name="skillBonusCollection" key="bonusType" columns="bonusType,bonusValue"><row bonusType="damageMultiplierBonus" bonusValue="5"/></rowset></row>' %
+			(i, group_id, 3300 + group * skills + i, 'x' * 200, i % 16 + 1) for i in range(skills))
+
+		rows.append('<row groupName="Group %d" groupID="%d"><rowset name="skills" key="typeID" columns="typeName,groupID,typeID">%s</rowset></row>' % (group, group_id, skill_rows))
+
+	return envelope('<rowset name="skillGroups" key="groupID" columns="groupName,groupID">%s</rowset>' % ''.join(rows))
+
+class StubPool(object):
+
+	def __init__(self, responses):
+		self.responses = responses
+
+	def request(self, url, timing = None):
+		return self.responses[urlsplit(url).path.rsplit('/', 1)[-1].split('.')[0].lower()]
+
+	def open(self, url, timing = None):
+		return StringIO(self.request(url))
+
+	def clear(self):
+		pass
+
+def percentile(values, fraction):
+
+	values = sorted(values)
+	return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def measure(name, function, rows, size, runs = 20, memory = True):
+
+	gc.collect()
+	times = []
+
+	for i in range(runs):
+		start = time.time()
+		function()
+		times.append(time.time() - start)
+
+	median = percentile(times, 0.5)
+	result = {
+		'name': name,
+		'rows': rows,
+		'bytes': size,
+		'p50': median,
+		'p90': percentile(times, 0.9),
+		'rows_per_second': rows / median,
+		'megabytes_per_second': size / median / 1048576,
+		'peak_kilobytes': peak_memory(function) if memory else None,
+	}
+
+	RESULTS.append(result)
+	print('%-32s %8.1f ms p50 %8.1f ms p90 %10.0f rows/s %7.1f MB/s %9s KB peak' % (name, result['p50'] * 1000, result['p90'] * 1000,
+		result['rows_per_second'], result['megabytes_per_second'], result['peak_kilobytes'] if memory else '-'))
+
+	return result
+
+def memory_status(field):
+
+	with open('/proc/self/status') as f:
+		for line in f:
+			if line.startswith(field + ':'):
+				return int(line.split()[1])
+
+def peak_memory(function):
+
+	def child(connection):
+
+		gc.collect()
+
+		try:
+			# A forked child inherits the parent's peak RSS; on Linux it can be reset so that
+			# earlier benchmarks in the same run do not hide this one.
+			try:
+				with open('/proc/self/clear_refs', 'w') as f:
+					f.write('5')
+
+				peak = lambda: memory_status('VmHWM')
+				before = memory_status('VmRSS')
+
+			except IOError:
+				peak = lambda: resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+				before = peak()
+
+			function()
+			connection.send((peak() - before, None))
+
+		except Exception as er:
+			connection.send((None, '%s: %s' % (type(er).__name__, er)))
+
+	parent_connection, child_connection = Pipe()
+	process = Process(target = child, args = (child_connection,))
+	process.start()
+
+	# Without the parent's copy of the child end, recv() sees EOF if the child dies
+	# before sending anything.
+	child_connection.close()
+
+	try:
+		kilobytes, error = parent_connection.recv()
+	except EOFError:
+		kilobytes, error = None, 'no result from child process'
+	finally:
+		process.join()
+
+	if error is not None:
+		raise RuntimeError('peak memory measurement failed: %s' % error)
+
+	return kilobytes
+
+def bench_convert(runs, number = 20000):
+
+	pew = Pew()
+	converters = _row_type('entries', JOURNAL_COLUMNS)._converters
+	size = sum(len(value) for attr, value in JOURNAL_ROW) * number
+
+	def heuristic():
+		for i in range(number):
+			for attr, value in JOURNAL_ROW:
+				pew._parse_value(value)
+
+	def schema():
+		for i in range(number):
+			for attr, value in JOURNAL_ROW:
+				pew._convert_value(converters.get(attr), value)
+
+	measure('_parse_value journal %d' % number, heuristic, number, size, runs, memory = False)
+	measure('_convert_value journal %d' % number, schema, number, size, runs, memory = False)
+
+def bench_lazy(runs, skills = 20000):
+
+	xml = character_sheet(skills)
+
+	# Only the balance and name are read, which is where lazy results save work.
+	for name, pew in [('eager', Pew()), ('lazy', Pew().lazy())]:
+
+		def partial(pew = pew):
+			result = pew._handle_result(xml)
+			return result.balance, result.name, result
+
+		measure('%s character sheet' % name, partial, skills + skills // 4, len(xml), runs)
+
+def bench_parse(sizes, runs):
+
+	pew = Pew()
+
+	print('Parsing (_parse_xml, _handle_result):')
+
+	for rows in sizes:
+		for fixture, xml in (('assets', asset_list(rows)), ('journal', wallet_journal(rows))):
+			measure('_parse_xml %s %d' % (fixture, rows), lambda: pew._parse_xml(xml), rows, len(xml), runs)
+			measure('_handle_result %s %d' % (fixture, rows), lambda: pew._handle_result(xml), rows, len(xml), runs)
+
+	xml = skill_tree()
+	measure('_handle_result skill tree', lambda: pew._handle_result(xml), 40 * 12, len(xml), runs)
+
+def bench_methods(sizes, runs):
+
+	print('Public methods over a stub transport:')
+
+	for rows in sizes:
+		responses = {'assetlist': asset_list(rows), 'walletjournal': wallet_journal(rows), 'skilltree': skill_tree()}
+		pew = Pew(1, 'key', pool = StubPool(responses))
+
+		measure('char_asset_list %d' % rows, lambda: pew.char_asset_list(1), rows, len(responses['assetlist']), runs)
+		measure('char_wallet_journal %d' % rows, lambda: pew.char_wallet_journal(1), rows, len(responses['walletjournal']), runs)
+		measure('streaming journal %d' % rows, lambda: sum(1 for row in pew.streaming('entries').char_wallet_journal(1)), rows, len(responses['walletjournal']), runs)
+
+	measure('eve_skill_tree', lambda: pew.eve_skill_tree(), 40 * 12, len(responses['skilltree']), runs)
+
+def bench_backends(sizes, runs):
+
+	from xml.etree import ElementTree, cElementTree
+
+	backends = [('ElementTree', 'etree', ElementTree), ('cElementTree', 'etree', cElementTree), ('expat', 'expat', cElementTree)]
+	default = pew_module.ElementTree
+
+	print('XML backends (_parse_xml):')
+
+	try:
+		for rows in sizes:
+			for fixture, xml in (('assets', asset_list(rows)), ('journal', wallet_journal(rows))):
+				for name, backend, module in backends:
+					pew = Pew()
+					pew.xml_backend = backend
+					pew_module.ElementTree = module
+
+					measure('%s %s %d' % (name, fixture, rows), lambda: pew._parse_xml(xml), rows, len(xml), runs)
+	finally:
+		pew_module.ElementTree = default
+
+def bench_processes(sizes, runs, jobs = 8):
+
+	parse_pool = PewParsePool(threshold = 0)
+	threads = ThreadPool(jobs)
+
+	# Thread and process pools do not survive the fork used to measure peak memory.
+	print('Parsing %d journals at once, %d worker processes:' % (jobs, cpu_count()))
+
+	try:
+		for rows in sizes:
+			xml = wallet_journal(rows)
+
+			for name, pew in (('inline', Pew()), ('process pool', Pew(parse_pool = parse_pool))):
+				measure('%s %d' % (name, rows), lambda: threads.map(pew._handle_result, [xml] * jobs), rows * jobs, len(xml) * jobs, runs, memory = False)
+	finally:
+		threads.close()
+		parse_pool.close()
+
+BENCHMARKS = {
+	'backends': bench_backends,
+	'convert': bench_convert,
+	'lazy': bench_lazy,
+	'parse': bench_parse,
+	'processes': bench_processes,
+	'methods': bench_methods,
+}
+
+SIZED = ('backends', 'parse', 'methods', 'processes')
+
+if __name__ == "__main__":
+
+	parser = optparse.OptionParser(usage = '%prog [options] [benchmark ...]')
+	parser.add_option('--rows', default = '10000,100000', help = 'comma separated row counts for sized benchmarks')
+	parser.add_option('--runs', type = 'int', default = 20, help = 'timed runs per case')
+	parser.add_option('--json', help = 'also write results to this file')
+
+	options, names = parser.parse_args()
+	sizes = [int(rows) for rows in options.rows.split(',')]
+
+	for name in names or sorted(BENCHMARKS):
+		if name in SIZED:
+			BENCHMARKS[name](sizes, options.runs)
+		else:
+			BENCHMARKS[name](options.runs)
+
+	if options.json:
+		with open(options.json, 'w') as f:
+			json.dump(RESULTS, f, indent = 2)
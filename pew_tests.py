@@ -1,11 +1,70 @@
-import unittest, urllib, sys
+import unittest, urllib, urlparse, math, os, pickle, sys, time, shutil, socket, ssl, tempfile, threading, zlib
+import BaseHTTPServer, SocketServer
 
-from pew import Pew, PewApiError, PewConnectionError
+from array import array
+from cStringIO import StringIO
+from datetime import datetime
+from decimal import Decimal
+
+from pew import Pew, PewAsync, PewApiObject, PewApiError, PewConnectionError, PewMemoryCache, PewDiskCache, PewConnectionPool, PewSync, PewFileSyncStore, \
+	PewRateLimiter, PewFileRateLimiter, PewErrorBudget, PewScheduler, PewAssetIndex, PewReferenceData, PewMetrics, PewParsePool, PewParseMemo, PewOrderBook, PewError, \
+	_PewAsyncRequest
 
 CHAR_ID = 91399947
 API_ID = 286212
 API_KEY = '62aEKRovi2qlI4yE1HErDy8us5BAY0fLcawQHXxfIV7xFsYVo0LqB5lppco0nNS9'
 
+class PewTestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+	protocol_version = 'HTTP/1.1'
+
+	def do_GET(self):
+
+		server = self.server
+		body = server.respond(self.path)
+		encoding = self.headers.get('accept-encoding', '')
+
+		with server.lock:
+			server.requests.append((self.client_address, self.path))
+
+		self.send_response(200)
+
+		if server.compress and 'gzip' in encoding:
+			compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+			body = compressor.compress(body) + compressor.flush()
+			self.send_header('Content-Encoding', 'gzip')
+
+		self.send_header('Content-Type', 'text/xml')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, *args):
+		pass
+
+class PewTestServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+	daemon_threads = True
+
+	def __init__(self, respond, compress = False):
+
+		BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), PewTestHandler)
+
+		self.respond = respond
+		self.compress = compress
+		self.requests = []
+		self.lock = threading.Lock()
+		self.url = 'http://127.0.0.1:%d' % self.server_address[1]
+
+		thread = threading.Thread(target = self.serve_forever)
+		thread.daemon = True
+		thread.start()
+
+	def stop(self):
+
+		self.shutdown()
+		self.server_close()
+
 class PewTest(unittest.TestCase):
 
 	def setUp(self):
@@ -14,6 +73,45 @@ class PewTest(unittest.TestCase):
 	def assertHasMember(self, obj, member_name):
 		self.assertTrue(member_name in obj.__dict__)
 
+class PewFakeApiTest(PewTest):
+
+	client_type = Pew
+	client_args = (API_ID, API_KEY)
+
+	def setUp(self):
+
+		self.server = PewTestServer(self.respond)
+		self.active = {}
+		self.peak = {}
+		self.lock = threading.Lock()
+		self.pew = self.client_type(*self.client_args)
+		self.pew.api_url = self.server.url
+
+	def tearDown(self):
+
+		self.pew.pool.clear()
+		self.server.stop()
+
+	def respond(self, path):
+
+		query = urlparse.parse_qs(urlparse.urlsplit(path).query)
+		key = query['keyId'][0]
+		character_id = int(query['characterId'][0])
+
+		with self.lock:
+			self.active[key] = self.active.get(key, 0) + 1
+			self.peak[key] = max(self.peak.get(key, 0), self.active[key])
+
+		time.sleep(0.02)
+
+		with self.lock:
+			self.active[key] -= 1
+
+		if character_id % 5 == 0:
+			return '<?xml version="1.0"?><eveapi><error code="105">Invalid characterID.</error></eveapi>'
+
+		return '<?xml version="1.0"?><eveapi><result><characterID>%d</characterID></result></eveapi>' % character_id
+
 class PewCoreTests(PewTest):
 
 	def test__parse_value_handles_integers(self):
@@ -65,13 +163,66 @@ class PewCoreTests(PewTest):
 		self.assertEqual(result.test[0].x, 1)
 		self.assertEqual(result.test[1].x, 2)
 
+	def test__parse_xml_uses_compact_rows_for_declared_columns(self):
+
+		result = self.pew._parse_xml('<?xml version="1.0"?><a><rowset name="test" columns="x,y"><row x="1" y="a"/><row x="2" y="b">c</row></rowset></a>')
+		row = result.test[0]
+
+		self.assertIsInstance(row, PewApiObject)
+		self.assertEqual(row.__slots__, ('x', 'y'))
+		self.assertFalse(hasattr(row, '__dict__') and row.__dict__)
+		self.assertEqual((row.x, row.y), (1, 'a'))
+		self.assertEqual(result.test[1]._value, 'c')
+		self.assertIs(type(result.test[1]), type(row))
+
+	def test__parse_xml_reuses_row_types_across_calls(self):
+
+		xml = '<?xml version="1.0"?><a><rowset name="test" columns="x"><row x="1"/></rowset></a>'
+
+		first = self.pew._parse_xml(xml).test[0]
+		second = self.pew._parse_xml(xml).test[0]
+
+		self.assertIs(type(first), type(second))
+
+	def test__parse_xml_compact_rows_can_be_pickled(self):
+
+		result = self.pew._parse_xml('<?xml version="1.0"?><a><rowset name="test" columns="x"><row x="1"><rowset name="sub" columns="y"><row y="2"/></rowset></row></rowset></a>')
+		row = pickle.loads(pickle.dumps(result.test[0], pickle.HIGHEST_PROTOCOL))
+
+		self.assertIs(type(row), type(result.test[0]))
+		self.assertEqual(row.x, 1)
+		self.assertEqual(row.sub[0].y, 2)
+
+	def test__parse_xml_converts_known_columns(self):
+
+		result = self.pew._parse_xml('<?xml version="1.0"?><a><rowset name="test" columns="date,amount,name,bid"><row date="2012-07-04 12:30:00" amount="1234.56" name="007" bid="1"/></rowset><serverOpen>True</serverOpen></a>')
+		row = result.test[0]
+
+		self.assertEqual(row.date, datetime(2012, 7, 4, 12, 30))
+		self.assertEqual(row.amount, Decimal('1234.56'))
+		self.assertEqual(row.name, '007')
+		self.assertIs(row.bid, True)
+		self.assertIs(result.serverOpen, True)
+
+	def test__parse_xml_falls_back_to_heuristic_for_bad_values(self):
+
+		result = self.pew._parse_xml('<?xml version="1.0"?><a><rowset name="test" columns="date,x"><row date="soon" x="3"/></rowset></a>')
+
+		self.assertEqual(result.test[0].date, 'soon')
+		self.assertEqual(result.test[0].x, 3)
+
+	def test__parse_xml_applies_rowset_specific_types(self):
+
+		result = self.pew._parse_xml('<?xml version="1.0"?><a><rowset name="entries" columns="argName1"><row argName1="12345"/></rowset></a>')
+
+		self.assertEqual(result.entries[0].argName1, '12345')
+
 	def test__build_url_appends_params(self):
 
 		params = {'a': 1, 'b': 2, 'c': 3}
 		expected = '%s/%s?%s' % (self.pew.api_url, 'test1/test2.xml.aspx', urllib.urlencode(params))
-		self.pew._params = params
 
-		result = self.pew._build_url('test1', 'test2')
+		result = self.pew._build_url('test1', 'test2', params)
 
 		self.assertEqual(result, expected)
 
@@ -79,9 +230,8 @@ class PewCoreTests(PewTest):
 
 		params = {}
 		expected = '%s/%s' % (self.pew.api_url, 'test1/test2.xml.aspx')
-		self.pew._params = params
 
-		result = self.pew._build_url('test1', 'test2')
+		result = self.pew._build_url('test1', 'test2', params)
 
 		self.assertEqual(result, expected)
 
@@ -120,6 +270,1637 @@ class PewCoreTests(PewTest):
 		except PewConnectionError as er:
 			self.assertTrue(True)
 
+class PewExpatTests(PewCoreTests):
+
+	XML = '<?xml version="1.0" encoding="UTF-8"?><eveapi version="2"><currentTime>2012-07-04 12:00:00</currentTime><result>' \
+		'<name>Caf\xc3\xa9</name><balance>12.50</balance><empty/><blank>  </blank><mixed a="1"> text <b>2</b> tail </mixed>' \
+		'<rowset name="assets" columns="itemID,quantity"><row itemID="1" quantity="2"><rowset name="contents" columns="itemID"><row itemID="3"/></rowset></row></rowset>' \
+		'<rowset name="plain"><row x="\xc3\xa9"/></rowset>' \
+		'</result><cachedUntil>2012-07-04 13:00:00</cachedUntil></eveapi>'
+
+	def setUp(self):
+
+		self.pew = Pew(API_ID, API_KEY)
+		self.pew.xml_backend = 'expat'
+
+	def _dump(self, obj):
+
+		if isinstance(obj, list):
+			return [self._dump(item) for item in obj]
+
+		if isinstance(obj, PewApiObject):
+			names = list(getattr(obj, '__dict__', {})) + list(getattr(type(obj), '__slots__', ()))
+			return type(obj), dict((name, self._dump(getattr(obj, name))) for name in names if hasattr(obj, name))
+
+		return type(obj), obj
+
+	def test__parse_xml_matches_element_tree(self):
+
+		tree = Pew(API_ID, API_KEY)
+		tree.xml_backend = 'etree'
+
+		self.assertEqual(self._dump(self.pew._parse_xml(self.XML)), self._dump(tree._parse_xml(self.XML)))
+		self.assertEqual(self.pew._parse_xml(self.XML).result.name, u'Caf\xe9')
+
+class PewCacheTests(PewTest):
+
+	XML = '<?xml version="1.0" encoding="UTF-8"?><eveapi version="2"><currentTime>2012-07-04 12:00:00</currentTime><result><a>1</a></result><cachedUntil>2012-07-04 12:30:00</cachedUntil></eveapi>'
+
+	def setUp(self):
+
+		self.pew = Pew(API_ID, API_KEY, cache = PewMemoryCache())
+		self.requests = []
+		self.pew._raw_request = self._fake_raw_request
+
+	def _fake_raw_request(self, url):
+
+		self.requests.append(url)
+		return self.XML
+
+	def test__handle_result_sets_expiry_from_server_times(self):
+
+		result = self.pew._handle_result(self.XML)
+
+		self.assertEqual(result._cached_until.minute, 30)
+		self.assertAlmostEqual(result._expires, time.time() + 1800, delta = 5)
+
+	def test__request_uses_cache_until_expiry(self):
+
+		first = self.pew.acct_characters()
+		second = self.pew.acct_characters()
+
+		self.assertEqual(len(self.requests), 1)
+		self.assertIs(first, second)
+
+	def test__request_cache_keyed_by_params(self):
+
+		self.pew.char_account_balance(1)
+		self.pew.char_account_balance(2)
+		self.pew.char_account_balance(1)
+
+		self.assertEqual(len(self.requests), 2)
+
+	def test_memory_cache_ignores_expired_entries(self):
+
+		cache = PewMemoryCache()
+		cache.set('a', 1, time.time() - 1)
+
+		self.assertEqual(cache.get('a'), None)
+
+	def test_memory_cache_evicts_least_recently_used(self):
+
+		cache = PewMemoryCache(max_entries = 2)
+		cache.set('a', 1, time.time() + 60)
+		cache.set('b', 2, time.time() + 60)
+		cache.get('a')
+		cache.set('c', 3, time.time() + 60)
+
+		self.assertEqual(cache.get('a'), 1)
+		self.assertEqual(cache.get('b'), None)
+		self.assertEqual(cache.get('c'), 3)
+
+class PewDiskCacheTests(PewTest):
+
+	def setUp(self):
+
+		self.path = tempfile.mkdtemp()
+		self.requests = []
+
+	def tearDown(self):
+		shutil.rmtree(self.path)
+
+	def _fake_raw_request(self, url):
+
+		self.requests.append(url)
+		return PewCacheTests.XML
+
+	def test_disk_cache_survives_new_instance(self):
+
+		PewDiskCache(self.path).set(('a', 1), {'b': 2}, time.time() + 60)
+		result = PewDiskCache(self.path).get(('a', 1))
+
+		self.assertEqual(result, {'b': 2})
+
+	def test_disk_cache_ignores_expired_entries(self):
+
+		cache = PewDiskCache(self.path)
+		cache.set('a', 1, time.time() - 1)
+
+		self.assertEqual(cache.get('a'), None)
+
+	def test_disk_cache_ignores_corrupt_entries(self):
+
+		cache = PewDiskCache(self.path)
+		entries = {
+			'truncated': pickle.dumps({'b': 2}, pickle.HIGHEST_PROTOCOL)[:-3],
+			'missing class': 'cpew\nPewMissing\n)\x81.',
+			'missing module': 'cpew_missing\nPew\n)\x81.',
+			'garbage': '\xff' * 16,
+		}
+
+		for key, data in entries.items():
+			cache.set(key, None, time.time() + 60)
+
+			with open(cache._entry_path(key), 'wb') as f:
+				f.write(PewDiskCache._HEADER.pack(time.time() + 60) + data)
+
+			self.assertEqual(cache.get(key), None)
+
+	def test_disk_cache_evicts_to_size_bound(self):
+
+		cache = PewDiskCache(self.path, max_bytes = 4096)
+
+		for i in range(10):
+			cache.set(i, 'x' * 1024, time.time() + 60)
+
+		self.assertEqual(cache.get(0), None)
+		self.assertEqual(cache.get(9), 'x' * 1024)
+		self.assertTrue(sum(entry[2] for entry in cache._entries()) <= 4096)
+
+	def test_disk_cache_serves_results_across_restarts(self):
+
+		for i in range(2):
+			pew = Pew(API_ID, API_KEY, cache = PewDiskCache(self.path))
+			pew._raw_request = self._fake_raw_request
+			result = pew.eve_skill_tree()
+
+		self.assertEqual(len(self.requests), 1)
+		self.assertEqual(result.a, 1)
+
+class PewConnectionPoolTests(PewFakeApiTest):
+
+	def respond(self, path):
+		return PewCacheTests.XML
+
+	def test_pool_reuses_connections(self):
+
+		for i in range(5):
+			result = self.pew.char_account_balance(i)
+
+		clients = set(request[0] for request in self.server.requests)
+
+		self.assertEqual(result.a, 1)
+		self.assertEqual(len(self.server.requests), 5)
+		self.assertEqual(len(clients), 1)
+
+	def test_pool_decodes_gzip_responses(self):
+
+		self.server.compress = True
+		result = self.pew.pool.request(self.server.url + '/test')
+
+		self.assertEqual(result, PewCacheTests.XML)
+
+	def test_pool_raises_connection_error_on_refused_connection(self):
+
+		sock = socket.socket()
+		sock.bind(('127.0.0.1', 0))
+		url = 'http://127.0.0.1:%d/test' % sock.getsockname()[1]
+		sock.close()
+
+		pool = PewConnectionPool(timeout = 1)
+
+		self.assertRaises(PewConnectionError, pool.request, url)
+
+	def test_pool_bounds_checked_out_connections(self):
+
+		pool = PewConnectionPool(max_size = 1, timeout = 0.1)
+		stream = pool.open(self.server.url + '/test')
+
+		self.assertRaises(PewConnectionError, pool.open, self.server.url + '/test')
+
+		stream.read()
+		stream.close()
+
+		self.assertEqual(pool.request(self.server.url + '/test'), PewCacheTests.XML)
+
+	def test_pool_waits_for_a_free_connection(self):
+
+		pool = PewConnectionPool(max_size = 1, timeout = 5)
+		stream = pool.open(self.server.url + '/test')
+		threading.Timer(0.1, lambda: stream.read() and stream.close()).start()
+
+		self.assertEqual(pool.request(self.server.url + '/test'), PewCacheTests.XML)
+		self.assertEqual(len(self.server.requests), 2)
+
+	def test_pool_frees_connections_after_other_errors(self):
+
+		class FailingConnection(object):
+
+			def __init__(self, error):
+				self.error = error
+
+			def connect(self):
+				raise self.error
+
+			def close(self):
+				pass
+
+		errors = [ssl.CertificateError("hostname 'a' doesn't match 'b'"), RuntimeError('boom')]
+		pool = PewConnectionPool(max_size = 1, timeout = 0.1)
+		pool._connect = lambda host: FailingConnection(errors.pop(0))
+
+		self.assertRaises(PewConnectionError, pool.open, self.server.url + '/test', {})
+		self.assertRaises(RuntimeError, pool.open, self.server.url + '/test', {})
+		self.assertEqual(sum(pool._busy.values()), 0)
+
+	def test_pool_sends_requests_through_proxies(self):
+
+		pool = PewConnectionPool(proxies = {'http': self.server.url, 'https': 'proxy:3128'})
+
+		self.assertEqual(pool.request('http://api.example.invalid/test?a=1'), PewCacheTests.XML)
+		self.assertEqual(self.server.requests[0][1], 'http://api.example.invalid/test?a=1')
+
+		connection = pool._connect(('https', 'api.example.invalid', None))
+
+		self.assertEqual((connection.host, connection.port), ('proxy', 3128))
+		self.assertEqual(connection._tunnel_host, 'api.example.invalid')
+
+class PewConcurrencyTests(PewFakeApiTest):
+
+	def respond(self, path):
+
+		query = urlparse.parse_qs(urlparse.urlsplit(path).query)
+		values = (query['characterId'][0], query.get('ids', [''])[0])
+
+		return '<?xml version="1.0"?><eveapi><result><characterID>%s</characterID><ids>%s</ids></result></eveapi>' % values
+
+	def test_shared_instance_keeps_params_per_call(self):
+
+		errors = []
+
+		def worker(n):
+			try:
+				for i in range(20):
+					character_id = n * 1000 + i
+
+					if i % 2:
+						result = self.pew.char_mail_bodies(character_id, [n, i + 100])
+						self.assertEqual(result.ids, '%d,%d' % (n, i + 100))
+					else:
+						result = self.pew.char_account_balance(character_id)
+						self.assertEqual(result.ids, None)
+
+					self.assertEqual(result.characterID, character_id)
+
+			except Exception as er:
+				errors.append(er)
+
+		threads = [threading.Thread(target = worker, args = (n + 1,)) for n in range(8)]
+
+		for thread in threads:
+			thread.start()
+
+		for thread in threads:
+			thread.join()
+
+		self.assertEqual(errors, [])
+		self.assertEqual(len(self.server.requests), 160)
+
+class PewBatchTests(PewFakeApiTest):
+
+	client_args = (1, 'a')
+
+	def test_batch_returns_results_and_errors_per_job(self):
+
+		jobs = [('char_account_balance', {'character_id': i}) for i in range(1, 21)]
+		results = list(self.pew.batch(jobs))
+
+		failed = [r for r in results if r.error is not None]
+		succeeded = [r for r in results if r.error is None]
+
+		self.assertEqual(len(results), 20)
+		self.assertEqual(len(failed), 4)
+		self.assertTrue(all(isinstance(r.error, PewApiError) for r in failed))
+		self.assertTrue(all(r.result.characterID == r.job[1]['character_id'] for r in succeeded))
+
+	def test_batch_limits_concurrency_per_key(self):
+
+		other = Pew(2, 'b')
+		other.api_url = self.server.url
+
+		jobs = [(self.pew.char_account_balance, {'character_id': i}) for i in range(1, 13)]
+		jobs += [(other.char_account_balance, {'character_id': i}) for i in range(1, 13)]
+
+		results = list(self.pew.batch(jobs, workers = 8, key_limit = 2))
+		other.pool.clear()
+
+		self.assertEqual(len(results), 24)
+		self.assertEqual(self.peak, {'1': 2, '2': 2})
+
+	def test_batch_maps_connection_errors(self):
+
+		self.pew.api_url = 'http://127.0.0.1:1'
+		results = list(self.pew.batch([('eve_skill_tree', None)]))
+
+		self.assertTrue(isinstance(results[0].error, PewConnectionError))
+
+class PewAsyncTests(PewFakeApiTest):
+
+	client_type = PewAsync
+	client_args = (1, 'a')
+
+	def test_async_runs_requests_concurrently(self):
+
+		futures = [self.pew.char_account_balance(i) for i in range(1, 33)]
+		self.pew.run()
+
+		self.assertTrue(all(future.done() for future in futures))
+		self.assertTrue(self.peak['1'] > 1)
+		self.assertEqual(self.pew.char_account_balance(7).result().characterID, 7)
+
+	def test_async_maps_api_errors(self):
+
+		future = self.pew.char_account_balance(5)
+
+		self.assertRaises(PewApiError, future.result)
+
+	def test_async_rejects_blocking_only_features(self):
+
+		self.assertRaises(PewError, self.pew.streaming, 'entries')
+		self.assertRaises(PewError, self.pew.batch, [('eve_skill_tree', None)])
+		self.assertRaises(PewError, PewReferenceData, self.pew)
+		self.assertRaises(PewError, PewOrderBook().poll, self.pew, CHAR_ID)
+		self.assertEqual(self.server.requests, [])
+
+	def test_async_accepts_client_options(self):
+
+		limiter = PewRateLimiter(1000)
+		memo = PewParseMemo()
+		pew = PewAsync(1, 'a', limiter = limiter, parse_memo = memo)
+
+		self.assertEqual((pew.limiter, pew.parse_memo), (limiter, memo))
+
+	def test_async_maps_connection_errors(self):
+
+		self.pew.api_url = 'http://127.0.0.1:1'
+		future = self.pew.eve_skill_tree()
+
+		self.assertRaises(PewConnectionError, future.result)
+
+	def test_async_defers_requests_for_limiter(self):
+
+		self.pew.limiter = PewRateLimiter(50, burst = 1)
+		start = time.time()
+
+		futures = [self.pew.char_account_balance(i) for i in range(1, 7)]
+		self.pew.run()
+
+		self.assertTrue(all(future.done() for future in futures))
+		self.assertTrue(time.time() - start >= 0.09)
+
+	def test_async_resolves_each_host_once(self):
+
+		lookups = []
+		getaddrinfo = socket.getaddrinfo
+
+		def counting_getaddrinfo(*args):
+			lookups.append(args[0])
+			return getaddrinfo(*args)
+
+		socket.getaddrinfo = counting_getaddrinfo
+
+		try:
+			futures = [self.pew.char_account_balance(i) for i in range(1, 5)]
+			self.pew.run()
+		finally:
+			socket.getaddrinfo = getaddrinfo
+
+		self.assertEqual(futures[3].result().characterID, 4)
+		self.assertEqual(lookups, ['127.0.0.1'])
+
+	def _resolve_to(self, answers):
+
+		# pew.test resolves to the next list of local ports on each lookup.
+		lookups = []
+		getaddrinfo = socket.getaddrinfo
+
+		def fake_getaddrinfo(host, port, *args):
+			if host != 'pew.test':
+				return getaddrinfo(host, port, *args)
+
+			lookups.append(host)
+			return [(socket.AF_INET, socket.SOCK_STREAM, 6, '', ('127.0.0.1', p)) for p in answers.pop(0)]
+
+		socket.getaddrinfo = fake_getaddrinfo
+		self.addCleanup(setattr, socket, 'getaddrinfo', getaddrinfo)
+		self.pew.api_url = 'http://pew.test:%d' % self.server.server_address[1]
+
+		return lookups
+
+	def _closed_port(self):
+
+		sock = socket.socket()
+		sock.bind(('127.0.0.1', 0))
+		port = sock.getsockname()[1]
+		sock.close()
+
+		return port
+
+	def test_async_tries_each_resolved_address(self):
+
+		live = self.server.server_address[1]
+		lookups = self._resolve_to([[self._closed_port(), live]])
+
+		self.assertEqual(self.pew.char_account_balance(1).result().characterID, 1)
+		self.assertEqual(self.pew.char_account_balance(2).result().characterID, 2)
+		self.assertEqual(lookups, ['pew.test'])
+		self.assertEqual(_PewAsyncRequest._addresses[('pew.test', live)][1][0][1], ('127.0.0.1', live))
+
+	def test_async_resolves_again_after_failure_or_expiry(self):
+
+		live = self.server.server_address[1]
+		lookups = self._resolve_to([[self._closed_port()], [live], [live]])
+
+		self.assertRaises(PewConnectionError, self.pew.char_account_balance(1).result)
+		self.assertEqual(self.pew.char_account_balance(2).result().characterID, 2)
+		self.assertEqual(len(lookups), 2)
+
+		_PewAsyncRequest._addresses[('pew.test', live)] = (0, [(socket.AF_INET, ('127.0.0.1', self._closed_port()))])
+
+		self.assertEqual(self.pew.char_account_balance(3).result().characterID, 3)
+		self.assertEqual(len(lookups), 3)
+
+	def test_async_retries_retryable_errors(self):
+
+		failures = ['<?xml version="1.0"?><eveapi><error code="902">EVE backend database temporarily disabled</error></eveapi>'] * 2
+		respond = self.server.respond
+		self.server.respond = lambda path: failures.pop() if failures else respond(path)
+		self.pew.retries = 2
+		self.pew.backoff = 0.01
+
+		self.assertEqual(self.pew.char_account_balance(3).result().characterID, 3)
+		self.assertEqual(len(self.server.requests), 3)
+
+	def test_async_gives_up_after_retries(self):
+
+		attempts = []
+		self.pew.add_hook('request', lambda info: attempts.append(info['attempt']))
+		self.pew.api_url = 'http://127.0.0.1:%d' % self._closed_port()
+		self.pew.retries = 3
+		self.pew.backoff = 0.01
+
+		self.assertRaises(PewConnectionError, self.pew.eve_skill_tree().result)
+		self.assertEqual(attempts, [0, 1, 2, 3])
+
+	def test_async_does_not_retry_permanent_api_errors(self):
+
+		self.pew.retries = 3
+
+		self.assertRaises(PewApiError, self.pew.char_account_balance(5).result)
+		self.assertEqual(len(self.server.requests), 1)
+
+	def test_async_invokes_callbacks(self):
+
+		results = []
+		self.pew.char_account_balance(3).add_callback(lambda future: results.append(future.result().characterID))
+		self.pew.run()
+
+		self.assertEqual(results, [3])
+
+	def test_async_uses_cache(self):
+
+		self.pew.cache = PewMemoryCache()
+		self.server.respond = lambda path: PewCacheTests.XML
+
+		first = self.pew.eve_skill_tree().result()
+		second = self.pew.eve_skill_tree()
+
+		self.assertTrue(second.done())
+		self.assertIs(second.result(), first)
+
+class PewStreamingTests(PewFakeApiTest):
+
+	def setUp(self):
+
+		rows = ''.join('<row refID="%d" amount="%d.50"/>' % (i, i) for i in range(500))
+		assets = '<row itemID="1"><rowset name="contents"><row itemID="2"/><row itemID="3"/></rowset></row><row itemID="4"/>'
+
+		self.responses = {
+			'walletjournal': '<eveapi><result><rowset name="entries">%s</rowset></result></eveapi>' % rows,
+			'assetList': '<eveapi><result><rowset name="assets">%s</rowset></result></eveapi>' % assets,
+			'accountBalance': '<eveapi><error code="106">Must provide userID parameter for authentication.</error></eveapi>',
+		}
+
+		PewFakeApiTest.setUp(self)
+
+	def respond(self, path):
+		return self.responses[path.split('/')[2].split('.')[0]]
+
+	def test_streaming_yields_rows(self):
+
+		rows = list(self.pew.streaming('entries').char_wallet_journal(CHAR_ID))
+
+		self.assertEqual(len(rows), 500)
+		self.assertEqual(rows[499].refID, 499)
+		self.assertEqual(rows[1].amount, Decimal('1.50'))
+
+	def test_streaming_keeps_nested_rowsets(self):
+
+		rows = list(self.pew.streaming('assets').char_asset_list(CHAR_ID))
+
+		self.assertEqual([row.itemID for row in rows], [1, 4])
+		self.assertEqual([row.itemID for row in rows[0].contents], [2, 3])
+
+	def test_streaming_raises_api_errors(self):
+
+		rows = self.pew.streaming('accounts').char_account_balance(CHAR_ID)
+
+		self.assertRaises(PewApiError, list, rows)
+
+	def test_streaming_reuses_connection_once_consumed(self):
+
+		self.server.compress = True
+
+		for i in range(3):
+			list(self.pew.streaming('entries').char_wallet_journal(CHAR_ID))
+
+		clients = set(request[0] for request in self.server.requests)
+
+		self.assertEqual(len(clients), 1)
+
+	def test_streaming_is_throttled_and_retried(self):
+
+		limiter = PewRateLimiter(1000)
+		acquires = []
+		limiter.acquire = lambda tokens = 1: acquires.append(tokens)
+		failures = ['<eveapi><error code="902">EVE backend database temporarily disabled</error></eveapi>']
+
+		respond = self.server.respond
+		self.server.respond = lambda path: failures.pop() if failures else respond(path)
+		self.pew.limiter = limiter
+		self.pew.retries = 1
+		self.pew.backoff = 0.01
+
+		rows = list(self.pew.streaming('entries').char_wallet_journal(CHAR_ID))
+
+		self.assertEqual(len(rows), 500)
+		self.assertEqual(len(acquires), 2)
+
+	def test_streaming_does_not_change_original_client(self):
+
+		self.pew.streaming('entries')
+
+		self.assertEqual(self.pew._stream_rowset, None)
+
+class PewColumnarTests(PewTest):
+
+	XML = '<?xml version="1.0"?><eveapi><result><rowset name="entries" columns="date,refID,ownerName1,amount,taxAmount,argName1"><row date="2012-07-04 12:30:00" refID="10" ownerName1="A" amount="1.5" taxAmount="" argName1="7"/><row date="2012-07-04 12:31:00" refID="11" ownerName1="B" amount="-2.25" taxAmount="0.5" argName1="x"/></rowset></result></eveapi>'
+
+	def setUp(self):
+
+		self.pew = Pew(API_ID, API_KEY).columnar(use_numpy = False)
+		self.pew._raw_request = lambda url: self.XML
+
+	def test_columnar_builds_typed_arrays(self):
+
+		entries = self.pew.char_wallet_journal(CHAR_ID).entries
+
+		self.assertEqual(len(entries), 2)
+		self.assertEqual(entries.columns, ('date', 'refID', 'ownerName1', 'amount', 'taxAmount', 'argName1'))
+		self.assertEqual(entries.refID, array('l', [10, 11]))
+		self.assertEqual(entries.amount, array('d', [1.5, -2.25]))
+		self.assertEqual(entries['ownerName1'], ['A', 'B'])
+		self.assertEqual(entries.date[1] - entries.date[0], 60.0)
+
+	def test_columnar_marks_missing_numbers_and_keeps_text_columns(self):
+
+		entries = self.pew.char_wallet_journal(CHAR_ID).entries
+
+		self.assertTrue(math.isnan(entries.taxAmount[0]))
+		self.assertEqual(entries.argName1, ['7', 'x'])
+
+	def test_columnar_degrades_non_numeric_columns_to_lists(self):
+
+		result = self.pew._parse_xml('<a><rowset name="test" columns="x"><row x="1"/><row x="b"/></rowset></a>')
+
+		self.assertEqual(result.test.x, [1, 'b'])
+
+	def test_columnar_keeps_rows_for_nested_rowsets(self):
+
+		result = self.pew._parse_xml('<a><rowset name="assets" columns="itemID"><row itemID="1"><rowset name="contents" columns="itemID"><row itemID="2"/></rowset></row></rowset></a>')
+
+		self.assertEqual(result.assets[0].contents.itemID, array('l', [2]))
+
+	def test_columnar_results_are_cached_separately(self):
+
+		plain = Pew(API_ID, API_KEY, cache = PewMemoryCache())
+		plain._raw_request = lambda url: PewColumnarTests.XML.replace('<result>', '<currentTime>2012-07-04 12:00:00</currentTime><result>').replace('</result>', '</result><cachedUntil>2012-07-04 13:00:00</cachedUntil>')
+
+		columnar = plain.columnar(use_numpy = False).char_wallet_journal(CHAR_ID)
+		rows = plain.char_wallet_journal(CHAR_ID)
+
+		self.assertEqual(len(rows.entries), 2)
+		self.assertEqual(rows.entries[0].refID, 10)
+		self.assertEqual(columnar.entries.refID[0], 10)
+
+	def test_columnar_results_are_cached_per_array_type(self):
+
+		columnar = Pew(API_ID, API_KEY).columnar(use_numpy = False)
+		params = {'characterId': CHAR_ID}
+
+		self.assertEqual(columnar._cache_key('char', 'WalletJournal', params), columnar._clone()._cache_key('char', 'WalletJournal', params))
+		self.assertNotEqual(columnar._cache_key('char', 'WalletJournal', params), columnar._clone(_use_numpy = True)._cache_key('char', 'WalletJournal', params))
+
+class PewPagingTests(PewFakeApiTest):
+
+	def respond(self, path):
+
+		query = urlparse.parse_qs(urlparse.urlsplit(path).query)
+		from_id = int(query.get('fromID', ['6001'])[0])
+		row_count = int(query['rowCount'][0])
+		ids = range(from_id - 1, max(from_id - 1 - row_count, 0), -1)
+
+		rows = ''.join('<row refID="%d" transactionID="%d"/>' % (i, i) for i in ids)
+		name = 'transactions' if 'wallettransactions' in path else 'entries'
+
+		return '<?xml version="1.0"?><eveapi><result><rowset name="%s" columns="refID,transactionID">%s</rowset></result></eveapi>' % (name, rows)
+
+	def test_walk_pages_backwards_by_from_id(self):
+
+		ids = [row.refID for row in self.pew.walk('char_wallet_journal', CHAR_ID)]
+		paths = [request[1] for request in self.server.requests]
+
+		self.assertEqual(ids, range(6000, 0, -1))
+		self.assertEqual(len(paths), 3)
+		self.assertTrue('fromID' not in paths[0])
+		self.assertTrue('fromID=3441' in paths[1])
+		self.assertTrue('rowCount=2560' in paths[2])
+
+	def test_walk_passes_account_key(self):
+
+		rows = self.pew.walk(self.pew.corp_wallet_transactions, CHAR_ID, account_key = 1001)
+		next(rows)
+
+		self.assertTrue('accountKey=1001' in self.server.requests[0][1])
+
+	def test_walk_pages_lazy_results(self):
+
+		ids = [row.transactionID for row in self.pew.lazy().walk('char_wallet_transactions', CHAR_ID)]
+
+		self.assertEqual(ids, range(6000, 0, -1))
+
+	def test_walk_rejects_streaming_and_columnar_clients(self):
+
+		self.assertRaises(PewError, self.pew.streaming('entries').walk, 'char_wallet_journal', CHAR_ID)
+		self.assertRaises(PewError, self.pew.columnar().walk, 'char_wallet_journal', CHAR_ID)
+		self.assertRaises(PewError, PewAsync(API_ID, API_KEY).walk, 'char_wallet_journal', CHAR_ID)
+		self.assertEqual(self.server.requests, [])
+
+	def test_walk_raises_on_missing_rowset(self):
+
+		self.server.respond = lambda path: '<?xml version="1.0"?><eveapi><result><rowset name="other" columns="refID"/></result></eveapi>'
+
+		self.assertRaises(AttributeError, list, self.pew.walk('char_wallet_journal', CHAR_ID))
+
+	def test_walk_fetches_lazily(self):
+
+		rows = self.pew.walk('char_wallet_journal', CHAR_ID)
+		next(rows)
+
+		self.assertEqual(len(self.server.requests), 1)
+
+	def test_walk_prefetches_next_page(self):
+
+		rows = self.pew.walk('char_wallet_journal', CHAR_ID, prefetch = True)
+		next(rows)
+
+		deadline = time.time() + 5
+
+		while len(self.server.requests) < 2 and time.time() < deadline:
+			time.sleep(0.01)
+
+		self.assertEqual(len(self.server.requests), 2)
+		self.assertEqual(len(list(rows)), 5999)
+
+class PewSyncTests(PewFakeApiTest):
+
+	def setUp(self):
+
+		PewFakeApiTest.setUp(self)
+		self.newest = 3000
+		self.path = tempfile.mkdtemp()
+
+	def tearDown(self):
+
+		PewFakeApiTest.tearDown(self)
+		shutil.rmtree(self.path)
+
+	def respond(self, path):
+
+		if 'mailmessages' in path:
+			rows = ''.join('<row messageID="%d"/>' % i for i in (5, 3, 4))
+			return '<?xml version="1.0"?><eveapi><result><rowset name="messages" columns="messageID">%s</rowset></result></eveapi>' % rows
+
+		query = urlparse.parse_qs(urlparse.urlsplit(path).query)
+		from_id = int(query.get('fromID', [self.newest + 1])[0])
+		ids = range(from_id - 1, max(from_id - 1 - int(query['rowCount'][0]), 0), -1)
+		rows = ''.join('<row refID="%d"/>' % i for i in ids)
+
+		return '<?xml version="1.0"?><eveapi><result><rowset name="entries" columns="refID">%s</rowset></result></eveapi>' % rows
+
+	def test_sync_returns_only_new_rows(self):
+
+		sync = PewSync(self.pew)
+		first = sync.fetch('char_wallet_journal', CHAR_ID)
+		self.newest = 3010
+		second = sync.fetch('char_wallet_journal', CHAR_ID)
+
+		self.assertEqual(len(first), 3000)
+		self.assertEqual([row.refID for row in second], range(3001, 3011))
+		self.assertEqual(sync.fetch('char_wallet_journal', CHAR_ID), [])
+
+	def test_sync_stops_paging_at_known_rows(self):
+
+		sync = PewSync(self.pew)
+		sync.fetch('char_wallet_journal', CHAR_ID)
+		count = len(self.server.requests)
+		sync.fetch('char_wallet_journal', CHAR_ID)
+
+		self.assertEqual(count, 2)
+		self.assertEqual(len(self.server.requests), 3)
+
+	def test_sync_filters_unpaged_methods(self):
+
+		sync = PewSync(self.pew)
+		sync.store.set((API_ID, CHAR_ID, 'char_mail_messages', None), 3)
+
+		rows = sync.fetch('char_mail_messages', CHAR_ID)
+
+		self.assertEqual([row.messageID for row in rows], [4, 5])
+
+	def test_sync_reads_lazy_results(self):
+
+		rows = PewSync(self.pew.lazy()).fetch('char_mail_messages', CHAR_ID)
+		entries = PewSync(self.pew.lazy()).fetch('char_wallet_journal', CHAR_ID)
+
+		self.assertEqual([row.messageID for row in rows], [3, 4, 5])
+		self.assertEqual(len(entries), 3000)
+
+	def test_sync_rejects_columnar_clients(self):
+		self.assertRaises(PewError, PewSync(self.pew.columnar()).fetch, 'char_mail_messages', CHAR_ID)
+
+	def test_sync_rejects_async_clients(self):
+
+		pew = PewAsync(API_ID, API_KEY)
+		pew.api_url = self.server.url
+		sync = PewSync(pew)
+
+		self.assertRaises(PewError, sync.fetch, 'char_wallet_journal', CHAR_ID)
+		self.assertRaises(PewError, sync.fetch, 'char_mail_messages', CHAR_ID)
+		self.assertEqual(sync.store.get((API_ID, CHAR_ID, 'char_mail_messages', None)), None)
+		self.assertEqual(self.server.requests, [])
+
+	def test_file_store_persists_marks(self):
+
+		path = os.path.join(self.path, 'marks.json')
+		PewSync(self.pew, PewFileSyncStore(path)).fetch('char_mail_messages', CHAR_ID)
+
+		store = PewFileSyncStore(path)
+
+		self.assertEqual(store.get((API_ID, CHAR_ID, 'char_mail_messages', None)), 5)
+
+class PewIdListTests(PewFakeApiTest):
+
+	def respond(self, path):
+
+		query = urlparse.parse_qs(urlparse.urlsplit(path).query)
+
+		if 'mailbodies' in path:
+			rows = ''.join('<row messageID="%s">body %s</row>' % (i, i) for i in query['ids'][0].split(','))
+			return '<?xml version="1.0"?><eveapi><result><rowset name="messages" key="messageID" columns="messageID">%s</rowset></result></eveapi>' % rows
+
+		if 'names' in query:
+			rows = ''.join('<row name="%s" characterID="%d"/>' % (name, 1000 + len(name)) for name in query['names'][0].split(','))
+		else:
+			rows = ''.join('<row name="pilot %s" characterID="%s"/>' % (i, i) for i in query['ids'][0].split(','))
+
+		return '<?xml version="1.0"?><eveapi><result><rowset name="characters" columns="name,characterID">%s</rowset></result></eveapi>' % rows
+
+	def test_id_lists_are_chunked_and_merged(self):
+
+		result = self.pew.char_mail_bodies(CHAR_ID, range(1, 251))
+
+		self.assertEqual(len(self.server.requests), 3)
+		self.assertEqual(sorted(row.messageID for row in result.messages), range(1, 251))
+
+	def test_id_lists_are_merged_for_lazy_and_columnar_clients(self):
+
+		lazy = self.pew.lazy().char_mail_bodies(CHAR_ID, range(1, 251))
+		columnar = self.pew.columnar(use_numpy = False).char_mail_bodies(CHAR_ID, range(1, 251))
+
+		self.assertEqual(sorted(row.messageID for row in lazy.messages), range(1, 251))
+		self.assertEqual(sorted(columnar.messages.messageID), range(1, 251))
+
+	def test_id_lists_are_filtered_for_columnar_clients(self):
+
+		result = self.pew.columnar(use_numpy = False).char_mail_bodies(CHAR_ID, [3, 1, 3])
+
+		self.assertEqual(list(result.messages.messageID), [3, 1])
+
+	def test_lookups_return_rows_for_lazy_and_columnar_clients(self):
+
+		lazy = self.pew.lazy().eve_character_name([1, 2, 3])
+		columnar = self.pew.columnar(use_numpy = False).eve_character_name([3, 4])
+
+		self.assertEqual([row.name for row in lazy.characters], ['pilot 1', 'pilot 2', 'pilot 3'])
+		self.assertEqual(list(columnar.characters.characterID), [3, 4])
+		self.assertEqual(columnar.characters['name'], ['pilot 3', 'pilot 4'])
+		self.assertEqual(len(self.server.requests), 2)
+
+	def test_async_id_lists_are_chunked_and_merged(self):
+
+		pew = PewAsync(API_ID, API_KEY)
+		pew.api_url = self.server.url
+		result = pew.char_mail_bodies(CHAR_ID, range(1, 251) + [1]).result()
+
+		self.assertEqual(len(self.server.requests), 3)
+		self.assertEqual(sorted(row.messageID for row in result.messages), range(1, 251))
+
+	def test_async_lookups_are_memoized(self):
+
+		pew = PewAsync(API_ID, API_KEY)
+		pew.api_url = self.server.url
+		pew.eve_character_name(range(1, 301)).result()
+		result = pew.eve_character_name([2, 301]).result()
+		cached = pew.eve_character_name([1]).result()
+
+		self.assertEqual(len(self.server.requests), 3)
+		self.assertEqual([row.name for row in result.characters], ['pilot 2', 'pilot 301'])
+		self.assertEqual(cached.characters[0].name, 'pilot 1')
+
+	def test_character_names_are_memoized(self):
+
+		self.pew.eve_character_name([1, 2])
+		result = self.pew.eve_character_name([2, 3, 1])
+
+		self.assertEqual(len(self.server.requests), 2)
+		self.assertTrue('ids=3&' in self.server.requests[1][1] or self.server.requests[1][1].endswith('ids=3'))
+		self.assertEqual([row.name for row in result.characters], ['pilot 2', 'pilot 3', 'pilot 1'])
+
+	def test_character_ids_are_memoized_case_insensitively(self):
+
+		self.pew.eve_character_id(['Abc'])
+		result = self.pew.eve_character_id(['abc'])
+
+		self.assertEqual(len(self.server.requests), 1)
+		self.assertEqual(result.characters[0].characterID, 1003)
+
+	def test_concurrent_lookups_are_coalesced(self):
+
+		self.pew.coalesce_window = 0.2
+		results = {}
+
+		def lookup(i):
+			results[i] = self.pew.eve_character_name([i, i + 100])
+
+		threads = [threading.Thread(target = lookup, args = (i,)) for i in range(1, 6)]
+
+		for thread in threads:
+			thread.start()
+
+		for thread in threads:
+			thread.join()
+
+		self.assertEqual(len(self.server.requests), 1)
+		self.assertEqual([row.characterID for row in results[3].characters], [3, 103])
+
+class PewThrottlingTests(PewTest):
+
+	def setUp(self):
+
+		self.pew = Pew(API_ID, API_KEY)
+		self.pew.backoff = 0.01
+		self.failures = []
+		self.calls = 0
+		self.pew._raw_request = self._fake_raw_request
+		self.path = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.path)
+
+	def _fake_raw_request(self, url):
+
+		self.calls += 1
+
+		if self.failures:
+			raise self.failures.pop(0)
+
+		return PewCacheTests.XML
+
+	def test_rate_limiter_spaces_requests(self):
+
+		limiter = PewRateLimiter(50, burst = 1)
+		start = time.time()
+
+		for i in range(6):
+			limiter.acquire()
+
+		self.assertTrue(time.time() - start >= 0.09)
+
+	def test_file_rate_limiter_is_shared_between_instances(self):
+
+		path = os.path.join(self.path, 'bucket')
+		limiters = [PewFileRateLimiter(path, 50, burst = 1) for i in range(2)]
+		start = time.time()
+
+		for i in range(3):
+			for limiter in limiters:
+				limiter.acquire()
+
+		self.assertTrue(time.time() - start >= 0.09)
+
+	def test_retries_connection_errors(self):
+
+		self.pew.retries = 2
+		self.failures = [PewConnectionError('reset'), PewApiError(902, 'EVE backend database temporarily disabled')]
+
+		result = self.pew.eve_skill_tree()
+
+		self.assertEqual(result.a, 1)
+		self.assertEqual(self.calls, 3)
+
+	def test_gives_up_after_retries(self):
+
+		self.pew.retries = 1
+		self.failures = [PewConnectionError('reset')] * 3
+
+		self.assertRaises(PewConnectionError, self.pew.eve_skill_tree)
+		self.assertEqual(self.calls, 2)
+
+	def test_does_not_retry_permanent_api_errors(self):
+
+		self.pew.retries = 3
+		self.failures = [PewApiError(203, 'Authentication failure.')]
+
+		self.assertRaises(PewApiError, self.pew.eve_skill_tree)
+		self.assertEqual(self.calls, 1)
+
+	def test_error_budget_pauses_key(self):
+
+		budget = PewErrorBudget(max_errors = 2, window = 0.2)
+		self.pew.error_budget = budget
+		self.failures = [PewApiError(203, 'Authentication failure.')] * 2
+
+		for i in range(2):
+			self.assertRaises(PewApiError, self.pew.eve_skill_tree)
+
+		start = time.time()
+		self.pew.eve_skill_tree()
+
+		self.assertTrue(time.time() - start >= 0.15)
+		self.assertEqual(budget.delay(API_ID + 1), 0)
+
+class PewSchedulerTests(PewTest):
+
+	def setUp(self):
+
+		self.calls = []
+		self.results = []
+		self.lock = threading.Lock()
+		self.scheduler = PewScheduler(workers = 4, retry_interval = 0.2, min_interval = 0.01)
+
+	def tearDown(self):
+		self.scheduler.stop()
+
+	def _method(self, name, lifetime):
+
+		with self.lock:
+			self.calls.append(name)
+
+		if lifetime is None:
+			raise PewConnectionError('down')
+
+		result = PewApiObject()
+		result._expires = time.time() + lifetime
+
+		return result
+
+	def _callback(self, subscription, result, error):
+
+		with self.lock:
+			self.results.append((subscription.args[0], error))
+
+	def test_scheduler_polls_at_cached_until(self):
+
+		self.scheduler.subscribe(self._method, ('fast', 0.1), callback = self._callback)
+		self.scheduler.subscribe(self._method, ('slow', 10), callback = self._callback)
+		self.scheduler.start()
+		time.sleep(0.45)
+		self.scheduler.stop()
+
+		self.assertTrue(4 <= self.calls.count('fast') <= 6)
+		self.assertEqual(self.calls.count('slow'), 1)
+		self.assertEqual(len(self.results), len(self.calls))
+
+	def test_scheduler_dispatches_in_due_order(self):
+
+		now = time.time()
+
+		for i in range(50):
+			self.scheduler.subscribe(self._method, (i, 10), due = now + (50 - i) * 0.001)
+
+		self.scheduler.workers = 1
+		self.scheduler.start()
+		time.sleep(0.3)
+
+		self.assertEqual(self.calls, range(49, -1, -1))
+
+	def test_scheduler_retries_errors_after_interval(self):
+
+		self.scheduler.subscribe(self._method, ('broken', None), callback = self._callback)
+		self.scheduler.start()
+		time.sleep(0.3)
+
+		self.assertEqual(self.calls, ['broken', 'broken'])
+		self.assertTrue(isinstance(self.results[0][1], PewConnectionError))
+
+	def test_unsubscribe_stops_polling(self):
+
+		subscription = self.scheduler.subscribe(self._method, ('fast', 0.05))
+		self.scheduler.start()
+		time.sleep(0.1)
+		self.scheduler.unsubscribe(subscription)
+		count = len(self.calls)
+		time.sleep(0.2)
+
+		self.assertTrue(len(self.calls) <= count + 1)
+
+class PewLazyTests(PewTest):
+
+	XML = '<?xml version="1.0"?><eveapi><currentTime>2012-07-04 12:00:00</currentTime><result><balance>12.50</balance><name>Pilot</name><attributes intelligence="20"/><rowset name="skills" columns="typeID,skillpoints"><row typeID="3300" skillpoints="256000"/></rowset><note x="1">text</note></result><cachedUntil>2012-07-04 13:00:00</cachedUntil></eveapi>'
+
+	def setUp(self):
+
+		self.pew = Pew(API_ID, API_KEY).lazy()
+		self.pew._raw_request = lambda url: self.XML
+
+	def test_lazy_values_match_eager_parse(self):
+
+		eager = Pew()._handle_result(self.XML)
+		lazy = self.pew.char_character_sheet(CHAR_ID)
+
+		self.assertEqual(lazy.balance, eager.balance)
+		self.assertEqual(lazy.name, eager.name)
+		self.assertEqual(lazy.attributes.intelligence, eager.attributes.intelligence)
+		self.assertEqual(lazy.skills[0].skillpoints, eager.skills[0].skillpoints)
+		self.assertEqual((lazy.note.x, lazy.note._value), (eager.note.x, eager.note._value))
+		self.assertEqual(lazy._cached_until, eager._cached_until)
+
+	def test_lazy_attributes_are_converted_on_first_access(self):
+
+		result = self.pew.char_character_sheet(CHAR_ID)
+
+		self.assertFalse('skills' in result.__dict__)
+		self.assertEqual(result.balance, Decimal('12.50'))
+		self.assertTrue('balance' in result.__dict__)
+		self.assertFalse('skills' in result.__dict__)
+
+	def test_lazy_missing_attributes_raise(self):
+
+		result = self.pew.char_character_sheet(CHAR_ID)
+
+		self.assertFalse(hasattr(result, 'missing'))
+		self.assertTrue('skills' in dir(result))
+
+	def test_lazy_errors_are_raised(self):
+
+		self.pew._raw_request = lambda url: '<?xml version="1.0"?><eveapi><error code="203">Authentication failure.</error></eveapi>'
+
+		self.assertRaises(PewApiError, self.pew.char_character_sheet, CHAR_ID)
+
+class PewAssetIndexTests(PewTest):
+
+	XML = '<?xml version="1.0"?><eveapi><result><rowset name="assets" columns="itemID,locationID,typeID,quantity,flag,singleton">' \
+		'<row itemID="1" locationID="60003760" typeID="587" quantity="1" flag="4" singleton="1">' \
+			'<rowset name="contents" columns="itemID,typeID,quantity,flag,singleton">' \
+				'<row itemID="2" typeID="34" quantity="100" flag="5" singleton="0"/>' \
+				'<row itemID="3" typeID="3467" quantity="1" flag="5" singleton="1">' \
+					'<rowset name="contents" columns="itemID,typeID,quantity,flag,singleton"><row itemID="4" typeID="34" quantity="50" flag="0" singleton="0"/></rowset>' \
+				'</row>' \
+			'</rowset>' \
+		'</row>' \
+		'<row itemID="5" locationID="30000142" typeID="34" quantity="7" flag="4" singleton="0"/>' \
+		'</rowset></result></eveapi>'
+
+	def setUp(self):
+
+		self.pew = Pew(API_ID, API_KEY)
+		self.index = PewAssetIndex(self.pew._handle_result(self.XML).assets)
+
+	def test_index_flattens_nested_assets(self):
+
+		self.assertEqual(len(self.index), 5)
+		self.assertEqual(sorted(row.itemID for row in self.index), [1, 2, 3, 4, 5])
+
+	def test_index_looks_up_by_type_and_location(self):
+
+		self.assertEqual(sorted(row.itemID for row in self.index.of_type(34)), [2, 4, 5])
+		self.assertEqual(sorted(row.itemID for row in self.index.at(60003760)), [1, 2, 3, 4])
+		self.assertEqual(self.index.location(4), 60003760)
+
+	def test_index_tracks_containers(self):
+
+		self.assertEqual(self.index.parent(4).itemID, 3)
+		self.assertEqual(self.index.parent(1), None)
+		self.assertEqual([row.itemID for row in self.index.contents(1)], [2, 3])
+
+	def test_index_rolls_up_quantities_per_location(self):
+
+		self.assertEqual(self.index.quantities(60003760), {587: 1, 34: 150, 3467: 1})
+		self.assertEqual(self.index.quantities(30000142), {34: 7})
+
+	def test_index_builds_from_streamed_rows(self):
+
+		rows = self.pew._iter_rowset(StringIO(self.XML), 'assets')
+
+		self.assertEqual(PewAssetIndex(rows).quantities(60003760)[34], 150)
+
+class PewReferenceDataTests(PewFakeApiTest):
+
+	RESULTS = {
+		'skilltree': '<rowset name="skillGroups" columns="groupName,groupID"><row groupName="Gunnery" groupID="255">'
+			'<rowset name="skills" columns="typeName,groupID,typeID,published"><row typeName="Gunnery" groupID="255" typeID="3300" published="1"/></rowset>'
+			'</row></rowset>',
+		'certificatetree': '<rowset name="categories" columns="categoryID,categoryName"><row categoryID="3" categoryName="Core">'
+			'<rowset name="classes" columns="classID,className"><row classID="2" className="Core Fitting">'
+			'<rowset name="certificates" columns="certificateID,grade,corporationID"><row certificateID="5" grade="1" corporationID="1000125"/></rowset>'
+			'</row></rowset></row></rowset>',
+		'reftypes': '<rowset name="refTypes" columns="refTypeID,refTypeName"><row refTypeID="10" refTypeName="Player Donation"/></rowset>',
+		'alliancelist': '<rowset name="alliances" columns="name,shortName,allianceID"><row name="Goonswarm" shortName="OHGOD" allianceID="824518128">'
+			'<rowset name="memberCorporations" columns="corporationID,startDate"><row corporationID="749147334" startDate="2008-01-01 00:00:00"/></rowset>'
+			'</row></rowset>',
+		'conquerablestationlist': '<rowset name="outposts" columns="stationID,stationName"><row stationID="61000001" stationName="Outpost"/></rowset>',
+		'errorlist': '<rowset name="errors" columns="errorCode,errorText"><row errorCode="105" errorText="Invalid characterID."/></rowset>',
+	}
+
+	client_args = ()
+
+	def setUp(self):
+
+		PewFakeApiTest.setUp(self)
+		self.lifetime = 3600
+		self.path = tempfile.mkdtemp()
+
+	def tearDown(self):
+
+		PewFakeApiTest.tearDown(self)
+		shutil.rmtree(self.path)
+
+	def respond(self, path):
+
+		name = urlparse.urlsplit(path).path.rsplit('/', 1)[-1].split('.')[0]
+		cached_until = datetime.utcfromtimestamp(1341403200 + self.lifetime).strftime('%Y-%m-%d %H:%M:%S')
+
+		return '<?xml version="1.0"?><eveapi><currentTime>2012-07-04 12:00:00</currentTime><result>%s</result><cachedUntil>%s</cachedUntil></eveapi>' % \
+			(self.RESULTS[name], cached_until)
+
+	def test_reference_data_indexes_datasets(self):
+
+		reference = PewReferenceData(self.pew)
+
+		self.assertEqual(reference.skill(3300).typeName, 'Gunnery')
+		self.assertEqual(reference.certificate(5).grade, 1)
+		self.assertEqual(reference.ref_type(10), 'Player Donation')
+		self.assertEqual(reference.alliance(824518128).shortName, 'OHGOD')
+		self.assertEqual(reference.alliance_of(749147334).allianceID, 824518128)
+		self.assertEqual(reference.station(61000001).stationName, 'Outpost')
+		self.assertEqual(reference.error(105), 'Invalid characterID.')
+
+	def test_reference_data_fetches_each_dataset_once(self):
+
+		reference = PewReferenceData(self.pew)
+		reference.skill(3300)
+		reference.skill(3301)
+
+		self.assertEqual(len(self.server.requests), 1)
+
+	def test_reference_data_loads_persisted_datasets(self):
+
+		PewReferenceData(self.pew, self.path).ref_type(10)
+		reference = PewReferenceData(self.pew, self.path)
+
+		self.assertEqual(reference.ref_type(10), 'Player Donation')
+		self.assertEqual(len(self.server.requests), 1)
+
+	def test_reference_data_refreshes_expired_datasets_in_background(self):
+
+		self.lifetime = -1
+		reference = PewReferenceData(self.pew)
+		self.assertEqual(reference.error(105), 'Invalid characterID.')
+
+		self.RESULTS = dict(self.RESULTS, errorlist = '<rowset name="errors" columns="errorCode,errorText"><row errorCode="105" errorText="Changed."/></rowset>')
+		self.lifetime = 3600
+		self.assertEqual(reference.error(105), 'Invalid characterID.')
+
+		for i in range(100):
+			if reference.error(105) == 'Changed.':
+				break
+			time.sleep(0.01)
+
+		self.assertEqual(reference.error(105), 'Changed.')
+		self.assertEqual(len(self.server.requests), 2)
+
+	def test_reference_data_waits_after_failed_refreshes(self):
+
+		self.lifetime = -1
+		respond = self.server.respond
+		garbled = '<?xml version="1.0"?><eveapi><result><rowset'
+		reshaped = '<?xml version="1.0"?><eveapi><result><rowset name="other" columns="errorCode"/></result></eveapi>'
+
+		for body in (garbled, reshaped):
+			self.server.respond = respond
+			reference = PewReferenceData(self.pew, retry_interval = 60)
+			reference.error(105)
+			self.server.respond = lambda path: body
+			del self.server.requests[:]
+
+			for i in range(20):
+				self.assertEqual(reference.error(105), 'Invalid characterID.')
+				time.sleep(0.005)
+
+			self.assertEqual(len(self.server.requests), 1)
+
+	def test_reference_data_shared_instance(self):
+
+		try:
+			self.assertTrue(PewReferenceData.shared(self.pew) is PewReferenceData.shared())
+		finally:
+			PewReferenceData._shared = None
+
+class PewInstrumentationTests(PewFakeApiTest):
+
+	XML = '<?xml version="1.0"?><eveapi><currentTime>2012-07-04 12:00:00</currentTime><result><serverOpen>True</serverOpen><onlinePlayers>31337</onlinePlayers></result><cachedUntil>2012-07-04 12:03:00</cachedUntil></eveapi>'
+
+	def setUp(self):
+
+		PewFakeApiTest.setUp(self)
+		self.pew.cache = PewMemoryCache()
+
+	def respond(self, path):
+
+		if 'characterId=105' in path:
+			return '<?xml version="1.0"?><eveapi><error code="105">Invalid characterID.</error></eveapi>'
+
+		if 'walletjournal' in path:
+			return '<?xml version="1.0"?><eveapi><result><rowset name="entries"><row refID="1"/><row refID="2"/></rowset></result></eveapi>'
+
+		return self.XML
+
+	def test_hooks_receive_request_phases(self):
+
+		events = []
+
+		for event in ('request', 'response', 'parse', 'error', 'cache'):
+			self.pew.add_hook(event, lambda info, event = event: events.append((event, dict(info))))
+
+		self.pew.misc_server_status()
+		self.pew.misc_server_status()
+
+		self.assertEqual([event for event, info in events], ['request', 'response', 'parse', 'cache'])
+
+		response = events[1][1]
+		self.assertEqual((response['api_type'], response['method_name']), ('server', 'serverstatus'))
+		self.assertEqual(response['bytes'], len(self.XML))
+
+		for phase in ('connect', 'server', 'transfer'):
+			self.assertTrue(response[phase] >= 0)
+
+		self.assertEqual(events[2][1]['result'].onlinePlayers, 31337)
+
+	def test_hooks_receive_errors(self):
+
+		errors = []
+		self.pew.add_hook('error', errors.append)
+
+		self.assertRaises(PewApiError, self.pew.char_character_sheet, 105)
+		self.assertEqual(errors[0]['error'].code, 105)
+
+	def test_hooks_receive_streaming_requests(self):
+
+		events = []
+
+		for event in ('request', 'response', 'parse', 'error'):
+			self.pew.add_hook(event, lambda info, event = event: events.append((event, dict(info))))
+
+		rows = list(self.pew.streaming('entries').char_wallet_journal(CHAR_ID))
+		self.assertRaises(PewApiError, list, self.pew.streaming('entries').char_wallet_journal(105))
+
+		self.assertEqual(len(rows), 2)
+		self.assertEqual([event for event, info in events], ['request', 'response', 'parse', 'request', 'response', 'error'])
+		self.assertEqual(events[1][1]['method_name'], 'walletjournal')
+		self.assertEqual(events[2][1]['rows'], 2)
+		self.assertEqual(events[5][1]['error'].code, 105)
+
+	def test_hooks_can_be_removed(self):
+
+		events = []
+		self.pew.add_hook('request', events.append)
+		self.pew.remove_hook('request', events.append)
+
+		self.assertEqual(self.pew._request_info('server', 'serverstatus', ''), None)
+		self.assertRaises(ValueError, self.pew.add_hook, 'unknown', events.append)
+
+	def test_metrics_collects_per_method(self):
+
+		metrics = PewMetrics().attach(self.pew)
+		self.pew.misc_server_status()
+		self.pew.misc_server_status()
+		self.assertRaises(PewApiError, self.pew.char_character_sheet, 105)
+
+		stats = metrics.snapshot()
+		status = stats[('server', 'serverstatus')]
+
+		self.assertEqual((status['requests'], status['cache_hits'], status['bytes']), (1, 1, len(self.XML)))
+		self.assertEqual(status['phases']['parse'][2], 1)
+		self.assertEqual(stats[('char', 'characterSheet')]['errors'], {105: 1})
+
+	def test_metrics_exports_prometheus_text(self):
+
+		metrics = PewMetrics(buckets = (0.5, 60)).attach(self.pew)
+		self.pew.misc_server_status()
+		self.assertRaises(PewApiError, self.pew.char_character_sheet, 105)
+		text = metrics.export()
+
+		self.assertTrue('pew_requests_total{api_type="server",method="serverstatus"} 1\n' in text)
+		self.assertTrue('pew_errors_total{api_type="char",method="characterSheet",code="105"} 1\n' in text)
+		self.assertTrue('pew_phase_seconds_bucket{api_type="server",method="serverstatus",phase="parse",le="60"} 1\n' in text)
+		self.assertTrue('pew_phase_seconds_count{api_type="server",method="serverstatus",phase="connect"} 1\n' in text)
+
+	def test_metrics_collects_async_requests(self):
+
+		pew = PewAsync(API_ID, API_KEY)
+		pew.api_url = self.server.url
+		metrics = PewMetrics().attach(pew)
+		pew.wait([pew.misc_server_status(), pew.char_character_sheet(105)])
+
+		stats = metrics.snapshot()
+
+		self.assertEqual(stats[('server', 'serverstatus')]['phases']['transfer'][2], 1)
+		self.assertEqual(stats[('server', 'serverstatus')]['phases']['parse'][2], 1)
+		self.assertEqual(stats[('char', 'characterSheet')]['errors'], {105: 1})
+
+class PewParsePoolTests(PewTest):
+
+	XML = '<?xml version="1.0"?><eveapi><currentTime>2012-07-04 12:00:00</currentTime><result><rowset name="entries" key="refID" columns="refID,amount,date">%s</rowset></result>' \
+		'<cachedUntil>2012-07-04 12:30:00</cachedUntil></eveapi>' % ''.join('<row refID="%d" amount="%d.50" date="2012-07-04 12:00:00"/>' % (i, i) for i in range(200))
+
+	@classmethod
+	def setUpClass(cls):
+		cls.parse_pool = PewParsePool(processes = 2, threshold = 1024)
+
+	@classmethod
+	def tearDownClass(cls):
+		cls.parse_pool.close()
+
+	def setUp(self):
+
+		self.parsed = []
+		self.pew = Pew(API_ID, API_KEY, parse_pool = self)
+		self.threshold = self.parse_pool.threshold
+
+	def parse(self, *args):
+
+		self.parsed.append(args)
+		return self.parse_pool.parse(*args)
+
+	def test_pool_parses_large_responses(self):
+
+		result = self.pew._handle_result(self.XML)
+		inline = Pew()._handle_result(self.XML)
+
+		self.assertEqual(len(self.parsed), 1)
+		self.assertEqual([(row.refID, row.amount, row.date) for row in result.entries], [(row.refID, row.amount, row.date) for row in inline.entries])
+		self.assertIs(type(result.entries[0]), type(inline.entries[0]))
+		self.assertTrue(result._expires > time.time())
+
+	def test_pool_leaves_small_responses_inline(self):
+
+		result = self.pew._handle_result(PewCacheTests.XML)
+
+		self.assertEqual(result.a, 1)
+		self.assertEqual(self.parsed, [])
+
+	def test_pool_raises_api_errors(self):
+
+		xml = '<?xml version="1.0"?><eveapi><error code="105">%s</error></eveapi>' % ('x' * 2048)
+
+		self.assertRaises(PewApiError, self.pew._handle_result, xml)
+
+	def test_pool_returns_columnar_results(self):
+
+		result = self.pew.columnar(use_numpy = False)._handle_result(self.XML)
+
+		self.assertEqual(len(self.parsed), 1)
+		self.assertEqual(list(result.entries.refID), range(200))
+
+	def test_pool_skips_lazy_results(self):
+
+		result = self.pew.lazy()._handle_result(self.XML)
+
+		self.assertEqual(result.entries[5].refID, 5)
+		self.assertEqual(self.parsed, [])
+
+class PewSingleFlightTests(PewFakeApiTest):
+
+	def respond(self, path):
+
+		time.sleep(0.2)
+
+		if 'characterId=105' in path:
+			return '<?xml version="1.0"?><eveapi><error code="105">Invalid characterID.</error></eveapi>'
+
+		return PewInstrumentationTests.XML
+
+	def _concurrently(self, function, count = 8):
+
+		results = []
+
+		def run():
+			try:
+				results.append(function())
+			except PewError as er:
+				results.append(er)
+
+		threads = [threading.Thread(target = run) for i in range(count)]
+
+		for thread in threads:
+			thread.start()
+
+		for thread in threads:
+			thread.join()
+
+		return results
+
+	def test_concurrent_identical_requests_share_one_fetch(self):
+
+		results = self._concurrently(self.pew.misc_server_status)
+
+		self.assertEqual(len(self.server.requests), 1)
+		self.assertEqual(len(set(id(result) for result in results)), 1)
+		self.assertEqual(results[0].onlinePlayers, 31337)
+
+	def test_concurrent_identical_requests_share_errors(self):
+
+		results = self._concurrently(lambda: self.pew.char_character_sheet(105))
+
+		self.assertEqual(len(self.server.requests), 1)
+		self.assertEqual(len(results), 8)
+		self.assertTrue(all(isinstance(result, PewApiError) and result.code == 105 for result in results))
+
+	def test_shared_requests_are_reported(self):
+
+		metrics = PewMetrics().attach(self.pew)
+		self._concurrently(self.pew.misc_server_status)
+		stats = metrics.snapshot()[('server', 'serverstatus')]
+
+		self.assertEqual((stats['requests'], stats['shared']), (1, 7))
+
+	def test_different_requests_are_not_shared(self):
+
+		self._concurrently(lambda: self.pew.char_character_sheet(CHAR_ID), 2)
+		self._concurrently(lambda: self.pew.lazy().char_character_sheet(CHAR_ID), 2)
+
+		self.assertEqual(len(self.server.requests), 2)
+		self.assertEqual(self.pew._flights, {})
+
+	def test_async_identical_requests_share_one_future(self):
+
+		pew = PewAsync(API_ID, API_KEY)
+		pew.api_url = self.server.url
+		first, second = pew.misc_server_status(), pew.misc_server_status()
+		pew.wait([first, second])
+
+		self.assertIs(first, second)
+		self.assertEqual(len(self.server.requests), 1)
+		self.assertIsNot(pew.misc_server_status(), first)
+
+	def test_async_shared_requests_are_reported(self):
+
+		pew = PewAsync(API_ID, API_KEY)
+		pew.api_url = self.server.url
+		shared = []
+		pew.add_hook('shared', shared.append)
+		pew.wait([pew.misc_server_status(), pew.misc_server_status()])
+
+		self.assertEqual(len(shared), 1)
+		self.assertEqual(shared[0]['result'].onlinePlayers, 31337)
+
+class PewParseMemoTests(PewTest):
+
+	XML = '<?xml version="1.0"?><eveapi><currentTime>%s</currentTime><result><rowset name="refTypes" key="refTypeID" columns="refTypeID,refTypeName">' \
+		'<row refTypeID="10" refTypeName="Player Donation"/></rowset></result><cachedUntil>%s</cachedUntil></eveapi>'
+
+	def setUp(self):
+
+		self.memo = PewParseMemo(max_entries = 2)
+		self.pew = Pew(API_ID, API_KEY, parse_memo = self.memo)
+		self.parsed = 0
+		parse_xml = self.pew._parse_xml
+
+		def counting_parse_xml(xml):
+			self.parsed += 1
+			return parse_xml(xml)
+
+		self.pew._parse_xml = counting_parse_xml
+
+	def test_memo_skips_reparsing_when_only_timestamps_change(self):
+
+		first = self.pew._handle_result(self.XML % ('2012-07-04 12:00:00', '2012-07-04 13:00:00'))
+		second = self.pew._handle_result(self.XML % ('2012-07-04 14:00:00', '2012-07-04 14:30:00'))
+
+		self.assertEqual(self.parsed, 1)
+		self.assertEqual((self.memo.hits, self.memo.misses), (1, 1))
+		self.assertIsNot(first, second)
+		self.assertIs(first.refTypes, second.refTypes)
+		self.assertEqual(first._cached_until, datetime(2012, 7, 4, 13))
+		self.assertEqual(second._cached_until, datetime(2012, 7, 4, 14, 30))
+		self.assertTrue(second._expires - time.time() > 1700)
+
+	def test_memo_deep_copies_on_request(self):
+
+		self.memo.deep_copy = True
+		first = self.pew._handle_result(self.XML % ('2012-07-04 12:00:00', '2012-07-04 13:00:00'))
+		second = self.pew._handle_result(self.XML % ('2012-07-04 12:00:00', '2012-07-04 13:00:00'))
+
+		self.assertEqual(self.parsed, 1)
+		self.assertIsNot(first.refTypes[0], second.refTypes[0])
+		self.assertEqual(second.refTypes[0].refTypeName, 'Player Donation')
+
+	def test_memo_is_bounded(self):
+
+		for name in ('a', 'b', 'c', 'a'):
+			self.pew._handle_result(self.XML.replace('Player Donation', name) % ('2012-07-04 12:00:00', '2012-07-04 13:00:00'))
+
+		self.assertEqual(self.parsed, 4)
+		self.assertEqual((self.memo.hits, self.memo.misses), (0, 4))
+
+	def test_memo_separates_result_modes(self):
+
+		xml = self.XML % ('2012-07-04 12:00:00', '2012-07-04 13:00:00')
+		self.pew._handle_result(xml)
+
+		columnar = Pew(API_ID, API_KEY, parse_memo = self.memo).columnar(use_numpy = False)
+
+		self.assertEqual(list(columnar._handle_result(xml).refTypes.refTypeID), [10])
+		self.assertEqual(self.memo.misses, 2)
+
+	def test_memo_does_not_keep_errors(self):
+
+		xml = '<?xml version="1.0"?><eveapi><error code="105">Invalid characterID.</error></eveapi>'
+
+		self.assertRaises(PewApiError, self.pew._handle_result, xml)
+		self.assertRaises(PewApiError, self.pew._handle_result, xml)
+		self.assertEqual(self.parsed, 2)
+
+class PewOrderBookTests(PewTest):
+
+	XML = '<?xml version="1.0"?><eveapi><result><rowset name="orders" key="orderID" columns="orderID,charID,stationID,volEntered,volRemaining,minVolume,orderState,typeID,range,accountKey,duration,escrow,price,bid,issued">%s</rowset></result></eveapi>'
+	ROW = '<row orderID="%d" charID="1" stationID="60003760" volEntered="100" volRemaining="%d" minVolume="1" orderState="%d" typeID="34" range="32767" accountKey="1000" duration="90" escrow="0.00" price="%s" bid="0" issued="2012-07-04 12:00:00"/>'
+
+	def _orders(self, *rows):
+		return self.pew._parse_xml(self.XML % ''.join(self.ROW % row for row in rows)).result.orders
+
+	def _kinds(self, events):
+		return sorted((event.kind, event.order_id) for event in events)
+
+	def test_first_snapshot_creates_orders(self):
+
+		book = PewOrderBook()
+		events = book.update(CHAR_ID, self._orders((1, 100, 0, '5.00'), (2, 100, 0, '6.00')))
+
+		self.assertEqual(self._kinds(events), [('created', 1), ('created', 2)])
+		self.assertEqual(book.state(CHAR_ID, 1), (Decimal('5.00'), 100, 0))
+
+	def test_diff_reports_changes(self):
+
+		book = PewOrderBook()
+		book.update(CHAR_ID, self._orders((1, 100, 0, '5.00'), (2, 100, 0, '6.00'), (3, 100, 0, '7.00'), (4, 100, 0, '8.00')))
+		events = book.update(CHAR_ID, self._orders((1, 100, 0, '5.00'), (2, 40, 0, '5.50'), (3, 0, 2, '7.00'), (5, 10, 0, '9.00')))
+
+		self.assertEqual(self._kinds(events), [('closed', 3), ('created', 5), ('filled', 2), ('filled', 3), ('price_changed', 2), ('removed', 4)])
+
+		filled = [event for event in events if event.kind == 'filled' and event.order_id == 2][0]
+		self.assertEqual(filled.previous, (Decimal('6.00'), 100, 0))
+		self.assertEqual(filled.order.volRemaining, 40)
+
+	def test_snapshots_are_kept_per_key(self):
+
+		book = PewOrderBook()
+		book.update(('char', 1), self._orders((1, 100, 0, '5.00')))
+
+		self.assertEqual(self._kinds(book.update(('char', 2), self._orders((1, 100, 0, '5.00')))), [('created', 1)])
+		self.assertEqual(book.update(('char', 1), self._orders((1, 100, 0, '5.00'))), [])
+
+	def test_callback_receives_events(self):
+
+		events = []
+		book = PewOrderBook(callback = events.append)
+		book.update(CHAR_ID, self._orders((1, 100, 0, '5.00')))
+		book.forget(CHAR_ID)
+		book.update(CHAR_ID, self._orders((1, 100, 0, '5.00')))
+
+		self.assertEqual(self._kinds(events), [('created', 1), ('created', 1)])
+
 class PewAccountTests(PewTest):
 
 	def test_acct_characters(self):
@@ -402,6 +2183,50 @@ if __name__ == "__main__":
 
 	if tests == 'core':
 		suite = loader.loadTestsFromTestCase(PewCoreTests)
+	if tests == 'cache':
+		suite = loader.loadTestsFromTestCase(PewCacheTests)
+	if tests == 'diskcache':
+		suite = loader.loadTestsFromTestCase(PewDiskCacheTests)
+	if tests == 'pool':
+		suite = loader.loadTestsFromTestCase(PewConnectionPoolTests)
+	if tests == 'concurrency':
+		suite = loader.loadTestsFromTestCase(PewConcurrencyTests)
+	if tests == 'batch':
+		suite = loader.loadTestsFromTestCase(PewBatchTests)
+	if tests == 'async':
+		suite = loader.loadTestsFromTestCase(PewAsyncTests)
+	if tests == 'streaming':
+		suite = loader.loadTestsFromTestCase(PewStreamingTests)
+	if tests == 'columnar':
+		suite = loader.loadTestsFromTestCase(PewColumnarTests)
+	if tests == 'paging':
+		suite = loader.loadTestsFromTestCase(PewPagingTests)
+	if tests == 'sync':
+		suite = loader.loadTestsFromTestCase(PewSyncTests)
+	if tests == 'idlists':
+		suite = loader.loadTestsFromTestCase(PewIdListTests)
+	if tests == 'throttling':
+		suite = loader.loadTestsFromTestCase(PewThrottlingTests)
+	if tests == 'scheduler':
+		suite = loader.loadTestsFromTestCase(PewSchedulerTests)
+	if tests == 'lazy':
+		suite = loader.loadTestsFromTestCase(PewLazyTests)
+	if tests == 'assets':
+		suite = loader.loadTestsFromTestCase(PewAssetIndexTests)
+	if tests == 'reference':
+		suite = loader.loadTestsFromTestCase(PewReferenceDataTests)
+	if tests == 'instrumentation':
+		suite = loader.loadTestsFromTestCase(PewInstrumentationTests)
+	if tests == 'expat':
+		suite = loader.loadTestsFromTestCase(PewExpatTests)
+	if tests == 'parsepool':
+		suite = loader.loadTestsFromTestCase(PewParsePoolTests)
+	if tests == 'singleflight':
+		suite = loader.loadTestsFromTestCase(PewSingleFlightTests)
+	if tests == 'memo':
+		suite = loader.loadTestsFromTestCase(PewParseMemoTests)
+	if tests == 'orders':
+		suite = loader.loadTestsFromTestCase(PewOrderBookTests)
 	if tests == 'char':
 		suite = loader.loadTestsFromTestCase(PewCharacterTests)
 	if tests == 'corp':
@@ -418,6 +2243,28 @@ if __name__ == "__main__":
 		suite = unittest.TestSuite()
 
 		suite.addTests(loader.loadTestsFromTestCase(PewCoreTests))
+		suite.addTests(loader.loadTestsFromTestCase(PewCacheTests))
+		suite.addTests(loader.loadTestsFromTestCase(PewDiskCacheTests))
+		suite.addTests(loader.loadTestsFromTestCase(PewConnectionPoolTests))
+		suite.addTests(loader.loadTestsFromTestCase(PewConcurrencyTests))
+		suite.addTests(loader.loadTestsFromTestCase(PewBatchTests))
+		suite.addTests(loader.loadTestsFromTestCase(PewAsyncTests))
+		suite.addTests(loader.loadTestsFromTestCase(PewStreamingTests))
+		suite.addTests(loader.loadTestsFromTestCase(PewColumnarTests))
+		suite.addTests(loader.loadTestsFromTestCase(PewPagingTests))
+		suite.addTests(loader.loadTestsFromTestCase(PewSyncTests))
+		suite.addTests(loader.loadTestsFromTestCase(PewIdListTests))
+		suite.addTests(loader.loadTestsFromTestCase(PewThrottlingTests))
+		suite.addTests(loader.loadTestsFromTestCase(PewSchedulerTests))
+		suite.addTests(loader.loadTestsFromTestCase(PewLazyTests))
+		suite.addTests(loader.loadTestsFromTestCase(PewAssetIndexTests))
+		suite.addTests(loader.loadTestsFromTestCase(PewReferenceDataTests))
+		suite.addTests(loader.loadTestsFromTestCase(PewInstrumentationTests))
+		suite.addTests(loader.loadTestsFromTestCase(PewExpatTests))
+		suite.addTests(loader.loadTestsFromTestCase(PewParsePoolTests))
+		suite.addTests(loader.loadTestsFromTestCase(PewSingleFlightTests))
+		suite.addTests(loader.loadTestsFromTestCase(PewParseMemoTests))
+		suite.addTests(loader.loadTestsFromTestCase(PewOrderBookTests))
 		suite.addTests(loader.loadTestsFromTestCase(PewAccountTests))
 		suite.addTests(loader.loadTestsFromTestCase(PewCharacterTests))
 		suite.addTests(loader.loadTestsFromTestCase(PewCorpTests))